@@ -0,0 +1,265 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Local stand-ins for the gridpoint API, the french toast feed, and the posting API,
+# for benchmarks.load. Each can be made slow, flaky, or (for posting) rate limited.
+
+from collections import Counter
+from datetime import datetime, time as dt_time, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import json
+import random
+import re
+import threading
+import time
+
+from benchmarks.synthetic import make_document, make_gridpoint
+
+GRIDPOINT_PATH = re.compile(r"/gridpoints/(\w+)/(\d+),(\d+)$")
+
+
+class FakeServer:
+    """An HTTP server on a free local port. Each request waits latency seconds plus
+    up to jitter more, then fails with a 503 error_rate of the time, and otherwise
+    gets whatever respond returns."""
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.responses = Counter()
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(self))
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.httpd.server_port)
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def handle(self, method, path, headers, body):
+        """Return the (status, headers, body) of the response to a request."""
+        time.sleep(self.latency + self.jitter * self.random())
+        if self.random() < self.error_rate:
+            status, response_headers, response_body = 503, {}, b""
+        else:
+            status, response_headers, response_body = self.respond(
+                method, path, headers, body
+            )
+        with self.lock:
+            self.responses[status] += 1
+        return status, response_headers, response_body
+
+    def get_stats(self):
+        """Return the number of responses sent, by status."""
+        with self.lock:
+            return dict(self.responses)
+
+    def respond(self, method, path, headers, body):
+        raise NotImplementedError
+
+
+def make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, like the real APIs
+        protocol_version = "HTTP/1.1"
+
+        def handle_request(self, method):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+            status, headers, payload = server.handle(
+                method, self.path, self.headers, body
+            )
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class FakeGridpoints(FakeServer):
+    """Serves a synthetic forecast for every grid cell, padded out with another
+    layer of padding bytes ahead of the ones the bot reads, the way real documents
+    have dozens of layers. Set run to move to a new run, in which change_rate of the
+    cells get a new forecast. ETags are sent and checked, so unchanged cells get a
+    304 in reply to a conditional request."""
+
+    def __init__(self, days=7, padding=0, change_rate=1, **kwargs):
+        super().__init__(**kwargs)
+        self.days = days
+        self.padding = padding
+        self.change_rate = change_rate
+        self.run = 0
+        self.start_time = datetime.combine(
+            datetime.now().date(), dt_time(), timezone.utc
+        )
+        self.documents = {}
+
+    def get_revision(self, cell):
+        """Return the last run in which a cell's forecast changed."""
+        revision = self.run
+        while (
+            revision > 0
+            and random.Random("{}-{}".format(cell, revision)).random()
+            >= self.change_rate
+        ):
+            revision -= 1
+        return revision
+
+    def get_document(self, cell, revision):
+        key = (cell, revision)
+        with self.lock:
+            document = self.documents.get(key)
+        if document is None:
+            properties = make_gridpoint(
+                self.days, seed="{}-{}".format(*key), start=self.start_time
+            )
+            properties["updateTime"] = (
+                self.start_time + timedelta(minutes=revision)
+            ).isoformat()
+            filler = properties["snowfallAmount"]["values"][0]
+            size = len(json.dumps(filler)) + 2
+            layers = {
+                "updateTime": properties.pop("updateTime"),
+                "temperature": {"values": [filler] * (self.padding // size)},
+                **properties,
+            }
+            document = json.dumps(make_document(layers)).encode()
+            with self.lock:
+                self.documents[key] = document
+        return document
+
+    def respond(self, method, path, headers, body):
+        m = GRIDPOINT_PATH.match(path)
+        if method != "GET" or not m:
+            return 404, {}, b""
+        cell = m.groups()
+        revision = self.get_revision(cell)
+        etag = '"{}-{}-{}-{}"'.format(*cell, revision)
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        document = self.get_document(cell, revision)
+        return 200, {"Content-Type": "application/geo+json", "ETag": etag}, document
+
+    def set_run(self, run):
+        with self.lock:
+            self.run = run
+            # Only the current revisions can be asked for again
+            self.documents.clear()
+
+
+class FakeToast(FakeServer):
+    """Serves the french toast feed at /toast.xml, at a fixed level."""
+
+    def __init__(self, level="Severe", **kwargs):
+        super().__init__(**kwargs)
+        self.level = level
+
+    def respond(self, method, path, headers, body):
+        if method != "GET" or path != "/toast.xml":
+            return 404, {}, b""
+        etag = '"{}"'.format(self.level)
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        feed = "<rss><channel><status>Toast - {}</status></channel></rss>".format(
+            self.level
+        )
+        return 200, {"Content-Type": "application/xml", "ETag": etag}, feed.encode()
+
+
+class FakePosting(FakeServer):
+    """Accepts tweets at /1.1/statuses/update.json. rate_limit_rate of them are
+    turned away with a 429, and a rate limit that resets rate_limit_window seconds
+    later."""
+
+    def __init__(self, rate_limit_rate=0, rate_limit_window=1, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limit_window = rate_limit_window
+        self.next_id = 1
+
+    def respond(self, method, path, headers, body):
+        if method != "POST" or path != "/1.1/statuses/update.json":
+            return 404, {}, b""
+        if self.random() < self.rate_limit_rate:
+            return (
+                429,
+                {
+                    "x-rate-limit-remaining": "0",
+                    "x-rate-limit-reset": str(
+                        int(time.time() + self.rate_limit_window)
+                    ),
+                },
+                b"",
+            )
+        if not parse_qs(body.decode()).get("status"):
+            return 400, {}, b""
+        with self.lock:
+            tweet_id = str(self.next_id)
+            self.next_id += 1
+        return (
+            200,
+            {"Content-Type": "application/json", "x-rate-limit-remaining": "100"},
+            json.dumps({"id_str": tweet_id}).encode(),
+        )
+
+
+def serve(options, conn):
+    """Run a fake of each API in this process, with {name: keyword arguments} options,
+    and take commands from the other end of the conn pipe: ("run", n) to start run
+    n, ("stats",) for the number of responses each fake has sent by status, and
+    ("stop",) to exit. The fakes' {name: URL} are sent first."""
+    fakes = {
+        "gridpoints": FakeGridpoints(**options.get("gridpoints", {})),
+        "toast": FakeToast(**options.get("toast", {})),
+        "posting": FakePosting(**options.get("posting", {})),
+    }
+    for fake in fakes.values():
+        fake.start()
+    conn.send({name: fake.url for name, fake in fakes.items()})
+    while True:
+        command, *args = conn.recv()
+        if command == "run":
+            fakes["gridpoints"].set_run(*args)
+            conn.send(None)
+        elif command == "stats":
+            conn.send({name: fake.get_stats() for name, fake in fakes.items()})
+        else:
+            break
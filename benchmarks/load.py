@@ -0,0 +1,379 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Run from the repository root with `python -m benchmarks.load`. Runs the whole bot
+# (snowbot.run, posting included) for many locations against local fakes of the
+# gridpoint API, the french toast feed, and the posting API (see benchmarks.fakes),
+# which run in a separate process so that they don't compete with the bot for the
+# GIL. Reports throughput, latency percentiles, and memory. Nothing touches the
+# network, and the bot's own data is left alone.
+
+from collections import defaultdict
+from multiprocessing import get_context
+from urllib.parse import urlsplit
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.startup import use_directory
+from config import TIMEZONE
+
+
+def make_locations(count, accounts):
+    """Return count locations, each in its own grid cell, spread across accounts."""
+    return [
+        {
+            "name": "load-{}".format(i),
+            "office": "BOX",
+            "grid_x": i % 100,
+            "grid_y": i // 100,
+            "timezone": TIMEZONE,
+            "account": "account-{}".format(i % accounts),
+            "sinks": ["twitter"],
+            "french_toast": True,
+        }
+        for i in range(count)
+    ]
+
+
+def get_percentile(values, percent):
+    """Nearest-rank percentile, or None if there are no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+
+def summarize(seconds):
+    return {
+        "count": len(seconds),
+        "p50": get_percentile(seconds, 50),
+        "p99": get_percentile(seconds, 99),
+        "max": max(seconds, default=None),
+    }
+
+
+def get_peak_rss():
+    """Peak resident memory of this process so far, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Recorder:
+    """Times every location, HTTP request, and post the bot makes, by wrapping the
+    functions that make them."""
+
+    def __init__(self, hosts):
+        # {host: name of the fake}
+        self.hosts = hosts
+        self.latencies = defaultdict(list)
+        self.location_errors = 0
+
+    def install(self, snowbot):
+        from scripts import posting
+        from scripts.metrics import metrics
+
+        record_request = metrics.record_request
+
+        def record_request_timed(host, seconds, num_bytes=0, error=False):
+            self.latencies[self.hosts.get(host, host)].append(seconds)
+            record_request(host, seconds, num_bytes, error)
+
+        metrics.record_request = record_request_timed
+
+        post = posting.TwitterClient.post
+
+        def post_timed(client, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return post(client, *args, **kwargs)
+            finally:
+                self.latencies["posting"].append(time.perf_counter() - start)
+
+        posting.TwitterClient.post = post_timed
+
+        run_location = snowbot.run_location
+
+        def run_location_timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return run_location(*args, **kwargs)
+            except Exception:
+                self.location_errors += 1
+                raise
+            finally:
+                self.latencies["location"].append(time.perf_counter() - start)
+
+        snowbot.run_location = run_location_timed
+
+    def take(self):
+        """Return the latencies recorded since the last take, and start afresh."""
+        latencies, self.latencies = self.latencies, defaultdict(list)
+        return latencies
+
+
+def subtract_stats(after, before):
+    differences = {}
+    for name, stats in after.items():
+        previous = before.get(name, {})
+        differences[name] = {
+            status: n - previous.get(status, 0)
+            for status, n in stats.items()
+            if n > previous.get(status, 0)
+        }
+    return differences
+
+
+def run_load_test(args, directory, conn):
+    """Run the bot args.runs times against the fakes, and return the results."""
+    urls = conn.recv()
+    use_directory(directory)
+    import scripts.forecast
+    import scripts.french_toast
+    import snowbot
+
+    scripts.forecast.FORECAST_API_URL = (
+        urls["gridpoints"] + "/gridpoints/{office}/{grid_x},{grid_y}"
+    )
+    scripts.french_toast.FRENCH_TOAST_URL = urls["toast"] + "/toast.xml"
+    snowbot.LOCATIONS = make_locations(args.locations, args.accounts)
+    snowbot.SINKS = {
+        "twitter": {"type": "twitter", "api_url": urls["posting"] + "/1.1"}
+    }
+    snowbot.SECRETS_PATH = os.path.join(directory, "secrets.py")
+    credentials = dict.fromkeys(
+        ["consumer_api_key", "consumer_api_secret", "access_token", "access_key"], "x"
+    )
+    with open(snowbot.SECRETS_PATH, "w") as f:
+        accounts = {"account-{}".format(i): credentials for i in range(args.accounts)}
+        f.write("ACCOUNTS = {!r}\n".format(accounts))
+    recorder = Recorder({urlsplit(url).netloc: name for name, url in urls.items()})
+    recorder.install(snowbot)
+    sys.argv = ["snowbot.py"]
+
+    runs = []
+    conn.send(("stats",))
+    before = conn.recv()
+    for run in range(args.runs):
+        conn.send(("run", run))
+        conn.recv()
+        start = time.perf_counter()
+        snowbot.run()
+        wall = time.perf_counter() - start
+        conn.send(("stats",))
+        after = conn.recv()
+        responses = subtract_stats(after, before)
+        before = after
+        latencies = recorder.take()
+        runs.append(
+            {
+                "wall": wall,
+                "locations_per_second": args.locations / wall,
+                "requests_per_second": sum(
+                    n for stats in responses.values() for n in stats.values()
+                )
+                / wall,
+                "latency": {
+                    name: summarize(seconds) for name, seconds in latencies.items()
+                },
+                "responses": responses,
+                "peak_rss_mb": get_peak_rss(),
+            }
+        )
+    from scripts import store
+
+    outbox = store.get_connection().execute(
+        "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+    )
+    return {
+        "options": vars(args),
+        "runs": runs,
+        "location_errors": recorder.location_errors,
+        "outbox": dict(outbox.fetchall()),
+    }
+
+
+def print_results(results):
+    print(
+        "{:>3}  {:>8}  {:>10}  {:>10}  {:>17}  {:>17}  {:>17}  {:>8}".format(
+            "run",
+            "wall s",
+            "locs/s",
+            "reqs/s",
+            "location p50/p99",
+            "fetch p50/p99",
+            "post p50/p99",
+            "RSS MB",
+        )
+    )
+
+    def percentiles(latency, name):
+        stats = latency.get(name)
+        if not stats:
+            return "-"
+        return "{:.0f}/{:.0f} ms".format(stats["p50"] * 1000, stats["p99"] * 1000)
+
+    for ind, run in enumerate(results["runs"]):
+        print(
+            "{:>3}  {:>8.2f}  {:>10.1f}  {:>10.1f}  {:>17}  {:>17}  {:>17}  {:>8.1f}".format(
+                ind,
+                run["wall"],
+                run["locations_per_second"],
+                run["requests_per_second"],
+                percentiles(run["latency"], "location"),
+                percentiles(run["latency"], "gridpoints"),
+                percentiles(run["latency"], "posting"),
+                run["peak_rss_mb"],
+            )
+        )
+        for name, stats in sorted(run["responses"].items()):
+            if stats:
+                print(
+                    "       {}: {}".format(
+                        name,
+                        ", ".join(
+                            "{} {}".format(n, status)
+                            for status, n in sorted(stats.items())
+                        ),
+                    )
+                )
+    print(
+        "Locations that failed: {}; posts by status: {}".format(
+            results["location_errors"], results["outbox"] or "none"
+        )
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--locations", type=int, default=100)
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--days", type=int, default=7, help="days in each gridpoint forecast"
+    )
+    parser.add_argument(
+        "--padding",
+        type=int,
+        default=256,
+        help="KB of other layers in each gridpoint document (default: 256)",
+    )
+    parser.add_argument(
+        "--change-rate",
+        type=float,
+        default=0.5,
+        help="fraction of forecasts that change from one run to the next",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=50, help="gridpoint API latency, in ms"
+    )
+    parser.add_argument(
+        "--toast-latency", type=float, default=50, help="toast feed latency, in ms"
+    )
+    parser.add_argument(
+        "--post-latency", type=float, default=50, help="posting API latency, in ms"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=20,
+        help="extra random latency, up to this many ms",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="fraction of gridpoint requests that fail with a 503",
+    )
+    parser.add_argument("--toast-error-rate", type=float, default=0)
+    parser.add_argument("--post-error-rate", type=float, default=0)
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=0,
+        help="fraction of posts turned away with a 429",
+    )
+    parser.add_argument(
+        "--rate-limit-window",
+        type=float,
+        default=1,
+        help="seconds until a 429's rate limit resets",
+    )
+    parser.add_argument("--output", help="file to write the results to, as JSON")
+    return parser.parse_args()
+
+
+def get_fake_options(args):
+    return {
+        "gridpoints": {
+            "latency": args.latency / 1000,
+            "jitter": args.jitter / 1000,
+            "error_rate": args.error_rate,
+            "days": args.days,
+            "padding": args.padding * 1024,
+            "change_rate": args.change_rate,
+        },
+        "toast": {
+            "latency": args.toast_latency / 1000,
+            "jitter": args.jitter / 1000,
+            "error_rate": args.toast_error_rate,
+        },
+        "posting": {
+            "latency": args.post_latency / 1000,
+            "jitter": args.jitter / 1000,
+            "error_rate": args.post_error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "rate_limit_window": args.rate_limit_window,
+        },
+    }
+
+
+def run():
+    # The fakes' process is spawned, and imports this module afresh, so nothing it
+    # doesn't need is imported at the top
+    from benchmarks.fakes import serve
+    from scripts.logger import logger
+
+    args = parse_args()
+    context = get_context("spawn")
+    conn, fakes_conn = context.Pipe()
+    fakes = context.Process(
+        target=serve, args=(get_fake_options(args), fakes_conn), daemon=True
+    )
+    fakes.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run_load_test(args, directory, conn)
+            # Write out any log records before the directory goes
+            logger.flush()
+    finally:
+        conn.send(("stop",))
+        fakes.join(timeout=5)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,307 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Run from the repository root with `python -m benchmarks.run`. Everything runs
+# offline against synthetic gridpoint data.
+
+from datetime import datetime
+import argparse
+import copy
+import json
+import os
+import platform
+import subprocess
+import timeit
+
+from benchmarks.synthetic import make_gridpoint, make_gridpoints
+from config import TIMEZONE
+from scripts.forecast import (
+    diff_forecasts,
+    get_date_range,
+    make_forecast_sentences,
+    parse_snow_data,
+    parse_snow_data_thresholds,
+)
+from scripts.incremental import IncrementalForecast
+from scripts.intervals import parse_intervals, parse_valid_time
+from scripts.probability import (
+    ProbabilityIndex,
+    get_aggregate_probability,
+    get_probability_for_duration,
+)
+from scripts.tweets import make_thread, make_tweets
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+RESULTS_DIR = os.path.join(__location__, "results")
+
+# Forecast lengths to benchmark, in days, from a single day up to two months
+DAY_SIZES = [1, 7, 28, 56]
+GRID_COUNTS = [1, 10, 100]
+# Probability thresholds for a replay sweep
+SWEEP_THRESHOLDS = list(range(0, 100, 10))
+
+
+def get_snow_lookups(data):
+    """Return (start timestamp, duration) for every snowfall entry, as
+    parse_snow_data would look them up."""
+    return [
+        (interval.start, interval.duration)
+        for interval in parse_intervals(data["snowfallAmount"]["values"])
+    ]
+
+
+def get_aggregate_lookups(index, lookups):
+    """Return the lookups that span more than one probability period, with the index
+    of the period they start in."""
+    aggregate = []
+    for start, duration in lookups:
+        ind = index.find(start)
+        if ind is not None and index.ends[ind] < start + duration:
+            aggregate.append((start, duration, ind))
+    return aggregate
+
+
+def make_revision(data):
+    """Return a copy of a gridpoint with one snowfall and one probability value
+    changed, like a typical hourly update."""
+    data = copy.deepcopy(data)
+    for layer in ["snowfallAmount", "probabilityOfPrecipitation"]:
+        entry = data[layer]["values"][len(data[layer]["values"]) // 2]
+        entry["value"] = entry["value"] + 1
+    return data
+
+
+def make_incremental_update(data):
+    """Return a function that updates an IncrementalForecast with alternating
+    revisions of a gridpoint, so that every call recomputes one change."""
+    forecast = IncrementalForecast(TIMEZONE)
+    forecast.update(data)
+    revisions = [make_revision(data), data]
+    calls = [0]
+
+    def update():
+        calls[0] += 1
+        forecast.update(revisions[calls[0] % 2])
+
+    return update
+
+
+def make_benchmarks(quick=False):
+    """Return {name: (function, number of calls per timing)}."""
+    date_range = get_date_range()
+    benchmarks = {}
+    day_sizes = DAY_SIZES[:2] if quick else DAY_SIZES
+    grid_counts = GRID_COUNTS[:2] if quick else GRID_COUNTS
+
+    for days in day_sizes:
+        data = make_gridpoint(days)
+        index = ProbabilityIndex.from_data(data)
+        lookups = get_snow_lookups(data)
+        aggregate_lookups = get_aggregate_lookups(index, lookups)
+        benchmarks["parse_snow_data[{}d]".format(days)] = (
+            lambda data=data: parse_snow_data(data, date_range),
+            10,
+        )
+        # A sweep long enough to go through the Timeline, against the same sweep
+        # parsed one threshold at a time
+        benchmarks["parse_snow_data_thresholds[{}d]".format(days)] = (
+            lambda data=data: parse_snow_data_thresholds(
+                data, date_range, TIMEZONE, SWEEP_THRESHOLDS
+            ),
+            10,
+        )
+        benchmarks["parse_snow_data_thresholds[{}d,loop]".format(days)] = (
+            lambda data=data: [
+                parse_snow_data(data, date_range, TIMEZONE, threshold)
+                for threshold in SWEEP_THRESHOLDS
+            ],
+            10,
+        )
+        benchmarks["IncrementalForecast.update[{}d]".format(days)] = (
+            make_incremental_update(data),
+            10,
+        )
+        benchmarks["ProbabilityIndex[{}d]".format(days)] = (
+            lambda data=data: ProbabilityIndex.from_data(data),
+            10,
+        )
+        valid_times = [
+            x["validTime"]
+            for layer in ["snowfallAmount", "probabilityOfPrecipitation"]
+            for x in data[layer]["values"]
+        ]
+        benchmarks["parse_valid_time[{}d]".format(days)] = (
+            lambda valid_times=valid_times: [
+                parse_valid_time(vt) for vt in valid_times
+            ],
+            10,
+        )
+        benchmarks["parse_valid_time[{}d,uncached]".format(days)] = (
+            lambda valid_times=valid_times: [
+                parse_valid_time.__wrapped__(vt) for vt in valid_times
+            ],
+            10,
+        )
+        benchmarks["get_probability_for_duration[{}d]".format(days)] = (
+            lambda index=index, lookups=lookups: [
+                get_probability_for_duration(index, start, duration)
+                for start, duration in lookups
+            ],
+            10,
+        )
+        benchmarks["get_aggregate_probability[{}d]".format(days)] = (
+            lambda index=index, lookups=aggregate_lookups: [
+                get_aggregate_probability(index, start, duration, ind)
+                for start, duration, ind in lookups
+            ],
+            10,
+        )
+
+    for count in grid_counts:
+        grids = make_gridpoints(count, 7)
+        benchmarks["parse_snow_data[{}x7d]".format(count)] = (
+            lambda grids=grids: [parse_snow_data(data, date_range) for data in grids],
+            1,
+        )
+
+    current = parse_snow_data(make_gridpoint(7, seed=1), date_range)
+    prev = {
+        d.isoformat(): amount
+        for d, amount in parse_snow_data(make_gridpoint(7, seed=2), date_range).items()
+    }
+    diff = diff_forecasts(current, prev, date_range)
+    sentences = make_forecast_sentences(diff, date_range)
+    benchmarks["diff_forecasts"] = (
+        lambda: diff_forecasts(current, prev, date_range),
+        1000,
+    )
+    benchmarks["make_forecast_sentences"] = (
+        lambda: make_forecast_sentences(diff, date_range),
+        1000,
+    )
+    # Long multi-location digests, to show how packing scales
+    long_sentences = sentences * 20
+    longer_sentences = sentences * 200
+    benchmarks["make_tweets"] = (lambda: make_tweets(sentences), 1000)
+    benchmarks["make_tweets[digest]"] = (lambda: make_tweets(long_sentences), 100)
+    benchmarks["make_tweets[digest x10]"] = (
+        lambda: make_tweets(longer_sentences),
+        10,
+    )
+    # The same diff composed again, as for a location whose forecast hasn't changed
+    thread_sentences = tuple(long_sentences)
+    benchmarks["make_thread[cached]"] = (lambda: make_thread(thread_sentences), 1000)
+    return benchmarks
+
+
+def time_benchmarks(benchmarks, repeat, filter_str=None):
+    results = {}
+    for name, (func, number) in benchmarks.items():
+        if filter_str and filter_str not in name:
+            continue
+        times = timeit.repeat(func, number=number, repeat=repeat)
+        per_call = [t / number for t in times]
+        results[name] = {
+            "min": min(per_call),
+            "mean": sum(per_call) / len(per_call),
+            "number": number,
+            "repeat": repeat,
+        }
+        print("{:<45} {:>12.1f} µs".format(name, min(per_call) * 1e6))
+    return results
+
+
+def get_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path, threshold):
+    """Print how each benchmark changed from a baseline results file. Returns the
+    names of benchmarks that got slower by more than the threshold."""
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    print("\nCompared to {} ({}):".format(baseline["commit"], baseline_path))
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["min"] / baseline["results"][name]["min"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("{:<45} {:>8.2f}x{}".format(name, ratio, flag))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--quick", help="only run the smaller benchmark sizes", action="store_true"
+    )
+    parser.add_argument("--filter", help="only run benchmarks whose name has this")
+    parser.add_argument(
+        "--output",
+        help="where to write results (default: benchmarks/results/<commit>.json)",
+    )
+    parser.add_argument("--compare", help="results file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown, as a fraction, that counts as a regression (default: 0.1)",
+    )
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    commit = get_commit()
+    results = time_benchmarks(make_benchmarks(args.quick), args.repeat, args.filter)
+    output = args.output or os.path.join(RESULTS_DIR, commit + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "timestamp": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print("Wrote results to {}".format(output))
+    if args.compare and compare(results, args.compare, args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    run()
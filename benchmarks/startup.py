@@ -0,0 +1,174 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Run from the repository root with `python -m benchmarks.startup`. Times a cold start
+# of snowbot.py on the fast path, where every forecast is still fresh in the HTTP
+# cache and there's nothing to post, against a scratch database and cache, without
+# touching the network. Exits with an error if importing snowbot takes longer than
+# the budget, or if the fast path loads any of the heavy dependencies.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from config import TIMEZONE
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+REPO_DIR = os.path.join(__location__, "..")
+# Dependencies that only posting, parsing, or a real request should need
+HEAVY_MODULES = ["requests", "requests_oauthlib", "numpy", "pytz", "cProfile"]
+LOCATION = {
+    "name": "startup",
+    "office": "BOX",
+    "grid_x": 71,
+    "grid_y": 90,
+    "timezone": TIMEZONE,
+    "account": "default",
+    "sinks": ["twitter"],
+    "french_toast": True,
+}
+
+
+def use_directory(directory):
+    """Point the database, HTTP cache, and log at a scratch directory."""
+    from scripts import http_cache, store
+    from scripts.logger import logger
+
+    store.DATABASE_PATH = os.path.join(directory, "snowbot.db")
+    store.LEGACY_FORECAST_PATH = os.path.join(directory, "weather.json")
+    store.LEGACY_TOAST_PATH = os.path.join(directory, "toast.json")
+    http_cache.CACHE_DIR = os.path.join(directory, "http_cache")
+    logger.path = os.path.join(directory, "snowbot.log")
+
+
+def seed(directory):
+    """Set up the state of a run that has nothing to do: fresh cache entries for the
+    forecast and toast feed, a stored forecast and toast level, and credentials to
+    not post with."""
+    from scripts import http_cache, store
+    from scripts.forecast import FORECAST_API_URL
+    from scripts.french_toast import FRENCH_TOAST_URL
+
+    use_directory(directory)
+    headers = {"Cache-Control": "max-age=3600", "ETag": '"startup"'}
+    http_cache.store_entry(FORECAST_API_URL.format(**LOCATION), headers)
+    http_cache.store_entry(FRENCH_TOAST_URL, headers)
+    # Without a stored forecast, the run would fetch the forecast in full
+    store.save_run({LOCATION["name"]: {"2020-12-14": 0}}, ("low", None))
+    credentials = dict.fromkeys(
+        ["consumer_api_key", "consumer_api_secret", "access_token", "access_key"], ""
+    )
+    with open(os.path.join(directory, "secrets.py"), "w") as f:
+        f.write("ACCOUNTS = {!r}\n".format({"default": credentials}))
+
+
+def run_child(directory):
+    """Import and run snowbot once, and print the timings as JSON."""
+    start = time.perf_counter()
+    import snowbot
+
+    import_time = time.perf_counter() - start
+    use_directory(directory)
+    snowbot.LOCATIONS = [LOCATION]
+    snowbot.SECRETS_PATH = os.path.join(directory, "secrets.py")
+    sys.argv = ["snowbot.py"]
+    start = time.perf_counter()
+    snowbot.run()
+    run_time = time.perf_counter() - start
+    print(
+        json.dumps(
+            {
+                "import": import_time,
+                "run": run_time,
+                "loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+            }
+        )
+    )
+
+
+def time_cold_starts(directory, repeat):
+    """Return the child's timings, plus the wall time of the whole process, for each
+    of repeat cold starts."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--child", directory],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        sample = json.loads(proc.stdout.splitlines()[-1])
+        sample["process"] = time.perf_counter() - start
+        samples.append(sample)
+    return samples
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=100,
+        help="longest importing snowbot may take, in milliseconds (default: 100)",
+    )
+    parser.add_argument("--child", metavar="DIR", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    if args.child:
+        run_child(args.child)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        seed(directory)
+        samples = time_cold_starts(directory, args.repeat)
+    timings = {
+        key: statistics.median(sample[key] for sample in samples) * 1000
+        for key in ["import", "run", "process"]
+    }
+    print(
+        "import snowbot: {import:.1f} ms, fast path run: {run:.1f} ms, "
+        "whole process: {process:.1f} ms (median of {repeat})".format(
+            repeat=args.repeat, **timings
+        )
+    )
+    failed = False
+    if timings["import"] > args.budget:
+        print("Importing snowbot is over the {:g} ms budget".format(args.budget))
+        failed = True
+    loaded = sorted({name for sample in samples for name in sample["loaded"]})
+    if loaded:
+        print("The fast path loaded {}".format(", ".join(loaded)))
+        failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    run()
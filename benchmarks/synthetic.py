@@ -0,0 +1,91 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from datetime import datetime, time, timedelta, timezone
+import random
+
+# Durations NWS uses for gridpoint values, in hours. Short periods are far more common
+# than long ones.
+SNOW_DURATIONS = [1, 1, 2, 3, 3, 6, 6, 6, 12]
+PROBABILITY_DURATIONS = [1, 1, 1, 2, 3, 4, 6, 12]
+
+
+def make_series(rng, start, hours, durations, make_value):
+    """Return a list of {"validTime", "value"} entries covering the given hours."""
+    values = []
+    offset = 0
+    while offset < hours:
+        duration = min(rng.choice(durations), hours - offset)
+        values.append(
+            {
+                "validTime": "{}/PT{}H".format(
+                    (start + timedelta(hours=offset)).isoformat(), duration
+                ),
+                "value": make_value(),
+            }
+        )
+        offset += duration
+    return values
+
+
+def make_snow_value(rng):
+    # Mostly dry, with the occasional storm
+    if rng.random() < 0.6:
+        return 0
+    return round(rng.choice([0.5, 2.54, 5.08, 10.16, 20.32, 30.48]) * rng.random(), 2)
+
+
+def make_gridpoint(days, seed=0, start=None):
+    """Return the properties of a synthetic gridpoint document covering the given
+    number of days. The two series use independently chosen durations, so their
+    period boundaries don't line up, and the probability series starts an hour after
+    the snowfall series, like real NWS data often does."""
+    rng = random.Random(seed)
+    if start is None:
+        start = datetime.combine(datetime.now().date(), time(), timezone.utc)
+    hours = days * 24
+    return {
+        "updateTime": start.isoformat(),
+        "snowfallAmount": {
+            "uom": "wmoUnit:mm",
+            "values": make_series(
+                rng, start, hours, SNOW_DURATIONS, lambda: make_snow_value(rng)
+            ),
+        },
+        "probabilityOfPrecipitation": {
+            "uom": "wmoUnit:percent",
+            "values": make_series(
+                rng,
+                start + timedelta(hours=1),
+                hours,
+                PROBABILITY_DURATIONS,
+                lambda: rng.randint(0, 100),
+            ),
+        },
+    }
+
+
+def make_gridpoints(count, days, seed=0, start=None):
+    return [make_gridpoint(days, seed + i, start) for i in range(count)]
+
+
+def make_document(properties):
+    """Wrap gridpoint properties in a full API response document."""
+    return {"type": "Feature", "properties": properties}
@@ -6,13 +6,75 @@ REPO_URL = "https://github.com/molly/snowbot"
 # Precipitation probability above which we will add snowfall to prediction
 PROBABILITY_THRESHOLD = 0
 
-# Get these values from hitting this URL with your latitude and longitude:
+# Get these values from hitting this URL with your latitude and longitude, or give
+# locations a latitude and longitude instead (see LOCATIONS below):
 # https://www.weather.gov/documentation/services-web-api#/default/get_points__point_
 OFFICE = "BOX"  # resp["properties"]["officeId"]
 GRID_X = 70  # resp["properties"]["gridX"]
 GRID_Y = 76  # resp["properties"]["gridY"]
 TIMEZONE = "US/Eastern"
 
+# HTTP client settings. Requests that time out, fail to connect, or get a 429 or 5xx
+# response are retried with jittered exponential backoff.
+HTTP_TIMEOUT = 5  # seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 1  # seconds, doubled with each retry
+HTTP_MAX_BACKOFF = 30  # seconds
+HTTP_MAX_CONNECTIONS_PER_HOST = 4
+# Stop hitting a host for a while once this many requests to it have failed in a row
+CIRCUIT_BREAKER_THRESHOLD = 3
+CIRCUIT_BREAKER_COOLDOWN = 5 * 60  # 5 minutes
+
+# Polling intervals for --daemon mode. The bot polls every DAEMON_MIN_INTERVAL while a
+# forecast grid is being updated or has snow in it, and otherwise multiplies the
+# interval by DAEMON_BACKOFF after each quiet poll, up to DAEMON_MAX_INTERVAL.
+DAEMON_MIN_INTERVAL = 5 * 60  # 5 minutes
+DAEMON_MAX_INTERVAL = 60 * 60  # 1 hour
+DAEMON_BACKOFF = 2
+
+# How often --serve refetches the forecasts and toast level it serves, and how long it
+# keeps an idle client connection open
+SERVER_REFRESH_INTERVAL = 5 * 60  # 5 minutes
+SERVER_IDLE_TIMEOUT = 30  # seconds
+
+# Tweets are queued, then posted from each account in parallel. Posts that fail with a
+# rate limit, server error, or network error are retried with backoff, on later runs
+# if need be. Point POSTING_API_URL at a local fake server to test posting.
+POSTING_API_URL = "https://api.twitter.com/1.1"
+POSTING_TIMEOUT = 10  # seconds
+POSTING_RETRIES = 5  # attempts before giving up on a post
+POSTING_BACKOFF = 60  # seconds, doubled with each attempt
+POSTING_DEADLINE = 2 * 60  # longest a run waits on posting before leaving it for later
+
+# Places to send forecasts to, by name. Each location sends its forecast to all of the
+# sinks named in its "sinks" at once, each with its own timeout, so one that's slow
+# or down doesn't hold up the others. Types:
+#   "twitter": tweets from the location's account, or from "account" if given, to
+#       "api_url" if given and POSTING_API_URL otherwise
+#   "mastodon": posts to "instance_url" from "account" (an ACCOUNTS entry with an
+#       "access_token"), with optional "visibility"
+#   "webhook": POSTs each thread as JSON to "url", with optional "headers"
+#   "file": appends each thread as a line of JSON to "path"
+# Any sink can also set its own "timeout" in seconds.
+SINKS = {
+    "twitter": {"type": "twitter"},
+}
+SINK_TIMEOUT = 10  # seconds
+
+# How long to keep the grid looked up for a location's latitude and longitude
+POINTS_CACHE_TTL = 30 * 24 * 60 * 60  # 30 days
+
+# File to write run metrics to (see --metrics), or None to not write them
+METRICS_PATH = None
+
+# Log records below this level ("debug", "info", "warning", or "error") are dropped
+LOG_LEVEL = "info"
+# snowbot.log is rotated once it would grow past this size, keeping this many old ones
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 10 MB
+LOG_BACKUPS = 5
+# Longest a log record is held in memory before it's written out
+LOG_FLUSH_INTERVAL = 1  # seconds
+
 # If your bot isn't reporting Boston weather, set this to False or this will make no
 # sense
 ENABLE_FRENCH_TOAST = True
@@ -20,3 +82,25 @@ ENABLE_FRENCH_TOAST = True
 TOAST_GIF_DELAY = 24 * 60 * 60  # 24 hours
 # GIF to tweet if the french toast level is "severe"
 SEVERE_TOAST_GIF = "https://t.co/Bs8UzBRswG"
+# Longest to wait for the french toast level before tweeting the forecast without it
+TOAST_DEADLINE = 10  # seconds
+
+# Locations to forecast. The bot fetches each location's forecast concurrently, and
+# keeps a separate stored forecast for each one under its name. "account" picks which
+# credentials in ACCOUNTS (see secrets_template.py) to tweet from, "sinks" picks which
+# of SINKS to send its forecast to, and "french_toast" appends the french toast alert
+# level to that location's tweets. A location can give "latitude" and "longitude"
+# instead of "office", "grid_x", "grid_y", and "timezone", which are then looked up
+# and cached. Locations in the same grid cell share one forecast fetch per run.
+LOCATIONS = [
+    {
+        "name": "boston",
+        "office": OFFICE,
+        "grid_x": GRID_X,
+        "grid_y": GRID_Y,
+        "timezone": TIMEZONE,
+        "account": "default",
+        "sinks": ["twitter"],
+        "french_toast": ENABLE_FRENCH_TOAST,
+    },
+]
@@ -0,0 +1,137 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Replay archived gridpoint and french toast snapshots through the forecast pipeline,
+# without touching the network, and print the tweets the bot would have sent. Give
+# several thresholds to compare them:
+#
+#   python replay.py winter.tar.gz --threshold 0,30,50 --suppress-under 25.4,0
+
+from itertools import product
+import argparse
+import json
+from pytz import timezone
+
+from scripts.forecast import LESS_THAN_AN_INCH
+from scripts.replay import load_snapshots, replay
+from scripts.utils import *
+
+
+def parse_list(value):
+    return [float(x) for x in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "path",
+        help="directory, zip file, or tar archive of snapshots, named for the time "
+        "they were taken (Unix time, 20201215T120000Z, or ISO 8601) with .json for "
+        "gridpoints and .xml for the french toast feed, optionally gzipped",
+    )
+    parser.add_argument(
+        "--location",
+        help="name of the location in LOCATIONS that the snapshots are for "
+        "(default: the first one)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=parse_list,
+        default=[PROBABILITY_THRESHOLD],
+        help="comma-separated probability thresholds to replay with",
+    )
+    parser.add_argument(
+        "--suppress-under",
+        type=parse_list,
+        default=[LESS_THAN_AN_INCH],
+        help="comma-separated amounts, in mm, under which a change isn't tweeted if "
+        "both the old and new amounts are under it (0 tweets every change)",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="number of processes to parse snapshots with"
+    )
+    parser.add_argument(
+        "--output", help="file to write every replayed thread to, as JSON lines"
+    )
+    return parser.parse_args()
+
+
+def get_location(name):
+    for location in LOCATIONS:
+        if name is None or location["name"] == name:
+            return location
+    raise SystemExit("No location named {}".format(name))
+
+
+def print_threads(threads, tz):
+    for timestamp, tweets in threads:
+        print("[{}]".format(datetime.fromtimestamp(timestamp, tz).strftime("%c")))
+        print("\n\n".join(tweets))
+        print()
+
+
+def run():
+    args = parse_args()
+    location = get_location(args.location)
+    tz = timezone(location["timezone"])
+    snapshots = load_snapshots(
+        args.path, location["timezone"], args.threshold, args.workers
+    )
+    results = {
+        config: replay(snapshots, *config, location.get("french_toast"))
+        for config in product(args.threshold, args.suppress_under)
+    }
+
+    if len(results) == 1:
+        print_threads(next(iter(results.values())), tz)
+    else:
+        print(
+            "{:>10} {:>15} {:>8} {:>7}".format(
+                "threshold", "suppress under", "threads", "tweets"
+            )
+        )
+        for (threshold, suppress_under), threads in results.items():
+            print(
+                "{:>10} {:>15} {:>8} {:>7}".format(
+                    threshold,
+                    suppress_under,
+                    len(threads),
+                    sum(len(tweets) for _, tweets in threads),
+                )
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            for (threshold, suppress_under), threads in results.items():
+                for timestamp, tweets in threads:
+                    f.write(
+                        json.dumps(
+                            {
+                                "threshold": threshold,
+                                "suppress_under": suppress_under,
+                                "time": timestamp,
+                                "tweets": tweets,
+                            }
+                        )
+                        + "\n"
+                    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,205 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from urllib.parse import urlsplit
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import *
+from scripts.metrics import metrics
+
+# Responses worth retrying: the server is overloaded or asked us to slow down
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to a host that has been failing."""
+
+    def __init__(self, host):
+        super().__init__("Circuit open for {}".format(host))
+        self.host = host
+
+
+class CircuitBreaker:
+    """Stops requests to a host after repeated failures, then lets one through after
+    the cooldown to check if it has recovered."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Half-open: allow a trial request, and re-open if it fails
+                self.opened_at = None
+                self.failures = self.threshold - 1
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def release_on_close(resp, slot):
+    """Release a connection slot when a response is closed, and only the first time
+    it is."""
+    close = resp.close
+    once = threading.Lock()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if once.acquire(blocking=False):
+                slot.release()
+
+    resp.close = close_and_release
+
+
+class HttpClient:
+    """Keep-alive HTTP client shared by every request in a run."""
+
+    def __init__(
+        self,
+        headers=None,
+        timeout=HTTP_TIMEOUT,
+        retries=HTTP_RETRIES,
+        backoff=HTTP_BACKOFF,
+        max_backoff=HTTP_MAX_BACKOFF,
+        max_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_per_host = max_per_host
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_maxsize=max_per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.host_limits = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get_host_limit(self, host):
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_limits[host]
+
+    def get_breaker(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(
+                    CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN
+                )
+            return self.breakers[host]
+
+    def get_delay(self, attempt, resp):
+        """Seconds to wait before the next attempt. Honors a Retry-After given in
+        seconds, otherwise uses full-jitter exponential backoff."""
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.backoff * 2**attempt, self.max_backoff))
+
+    def request(self, method, url, deadline=None, **kwargs):
+        """Make a request, retrying connection errors, timeouts, and retryable
+        statuses. Raises CircuitOpenError without making a request if the host has
+        been failing, and raises for error responses once retries are used up. If a
+        deadline (a time.time() timestamp) is given, attempts are cut short and not
+        retried so that the request gives up at about that time.
+
+        A streamed response holds one of its host's connection slots until it is
+        closed, and its bytes are for whoever reads it to record."""
+        host = urlsplit(url).netloc
+        breaker = self.get_breaker(host)
+        if not breaker.allow():
+            raise CircuitOpenError(host)
+        timeout = kwargs.pop("timeout", self.timeout)
+        host_limit = self.get_host_limit(host)
+        stream = kwargs.get("stream", False)
+        for attempt in range(self.retries + 1):
+            resp, error = None, None
+            if deadline is not None:
+                kwargs["timeout"] = max(min(timeout, deadline - time.time()), 0.001)
+            else:
+                kwargs["timeout"] = timeout
+            start = time.perf_counter()
+            held = False
+            host_limit.acquire()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (
+                requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError,
+            ) as e:
+                error = e
+                metrics.record_request(host, time.perf_counter() - start, error=True)
+            else:
+                metrics.record_request(
+                    host,
+                    time.perf_counter() - start,
+                    0 if stream else len(resp.content),
+                    error=resp.status_code >= 400,
+                )
+                if stream and resp.status_code < 400:
+                    # The body is still to be downloaded, so the limit should cover it
+                    release_on_close(resp, host_limit)
+                    held = True
+            finally:
+                if not held:
+                    host_limit.release()
+            if resp is not None and resp.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                resp.raise_for_status()
+                return resp
+            if resp is not None:
+                resp.close()
+            if attempt < self.retries:
+                delay = self.get_delay(attempt, resp)
+                if deadline is not None and time.time() + delay >= deadline:
+                    break
+                time.sleep(delay)
+        breaker.record_failure()
+        if error:
+            raise error
+        resp.raise_for_status()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
@@ -18,56 +18,207 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from concurrent.futures import Future
 from datetime import date, timedelta
-from pytz import timezone
-import json
+from functools import lru_cache
+import threading
 
-from scripts.probability import get_probability_for_duration
+from scripts import store
+from scripts.gridpoint import GRIDPOINT_LAYERS
+from scripts.intervals import get_local_date, parse_intervals
+from scripts.metrics import metrics
+from scripts.probability import ProbabilityIndex, get_probability_for_duration
 from scripts.utils import *
 
 FORECAST_API_URL = "https://api.weather.gov/gridpoints/{office}/{grid_x},{grid_y}"
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+# Amounts under an inch are all shown as "<1 in."
+LESS_THAN_AN_INCH = 25.4  # mm
+# Setting up a Timeline costs about as much as a week's forecast parsed for five or so
+# thresholds one at a time (see benchmarks.run), so it's only used for sweeps over
+# more than that
+TIMELINE_MIN_THRESHOLDS = 8
+# Each location's last parsed forecast, so that a long-running process doesn't have to
+# load it from the database each time
+_incremental_forecasts = {}
 
 
-def get_date_range():
-    today = date.today()
+@lru_cache(maxsize=None)
+def get_timeline():
+    """Return the Timeline class, or None if NumPy isn't installed. NumPy is slow to
+    import, so it isn't loaded until there's a forecast to parse."""
+    try:
+        from scripts.timeline import Timeline
+    except ImportError:
+        # parse_snow_data_thresholds parses one threshold at a time instead
+        return None
+    return Timeline
+
+
+def get_date_range(today=None):
+    today = today or date.today()
     return [today + timedelta(days=x) for x in range(6)]
 
 
-def get_snow_data():
-    url = FORECAST_API_URL.format(office=OFFICE, grid_x=GRID_X, grid_y=GRID_Y)
-    data = fetch(url, True)
-    return {
-        "snowfallAmount": data["properties"]["snowfallAmount"],
-        "probabilityOfPrecipitation": data["properties"]["probabilityOfPrecipitation"],
-    }
+def get_snow_data(location, update_cache=True, conditional=True):
+    """Fetch the gridpoint forecast for a location. If conditional is set, the
+    forecast is NOT_MODIFIED if it hasn't changed since its validators were last
+    stored, and None if it couldn't be fetched. Returns the forecast, and a function
+    to call once it has been stored, which stores its validators (or None if there's
+    nothing to store, or update_cache isn't set)."""
+    url = FORECAST_API_URL.format(
+        office=location["office"], grid_x=location["grid_x"], grid_y=location["grid_y"]
+    )
+    # Stream the document and keep only the layers the forecast uses
+    return fetch_layers(
+        url, GRIDPOINT_LAYERS, conditional=conditional, update_cache=update_cache
+    )
+
 
+class GridpointFetches:
+    """Shares gridpoint fetches between the locations in a run, so that locations in
+    the same grid cell only fetch it once between them. Make a new one for each run."""
+
+    def __init__(self, update_cache=True):
+        self.update_cache = update_cache
+        self.fetches = {}
+        # {cell: names of the locations in it}
+        self.locations = {}
+        self.lock = threading.Lock()
+
+    def get(self, location):
+        """Return get_snow_data for a location, waiting on another location's fetch
+        of the same grid cell if there is one."""
+        cell = (location["office"], location["grid_x"], location["grid_y"])
+        with self.lock:
+            self.locations.setdefault(cell, set()).add(location["name"])
+            future = self.fetches.get(cell)
+            is_fetcher = future is None
+            if is_fetcher:
+                future = self.fetches[cell] = Future()
+        if not is_fetcher:
+            metrics.count("gridpoint_fetches_shared")
+            return future.result()[0]
+        try:
+            future.set_result(get_snow_data(location, self.update_cache))
+        except Exception as e:
+            future.set_exception(e)
+        return future.result()[0]
+
+    def store_validators(self, stored):
+        """Store the validators of each grid cell whose locations' forecasts have all
+        been stored (their names are in stored). A cell with a location that failed
+        is fetched in full again next run, so that location still sees the change."""
+        with self.lock:
+            cells = [
+                (future, self.locations[cell]) for cell, future in self.fetches.items()
+            ]
+        for future, names in cells:
+            if not future.done() or future.exception():
+                continue
+            _, update_cache = future.result()
+            if update_cache and names <= stored:
+                update_cache()
+
+
+def parse_snow_data(
+    data, date_range, tz_name=TIMEZONE, threshold=PROBABILITY_THRESHOLD
+):
+    """Return {date: total snowfall} for the snowfall in each date's forecast whose
+    probability meets the threshold."""
+    from pytz import timezone
 
-def parse_snow_data(data, date_range):
     weather = {d: 0 for d in date_range}
-    tz = timezone(TIMEZONE)
+    tz = timezone(tz_name)
     amounts = data["snowfallAmount"]["values"]
-    for amount in amounts:
-        if amount["value"] > 0:
-            [datetime_str, duration] = parse_duration_string(amount["validTime"])
-            start_time = datetime.fromisoformat(datetime_str).astimezone(tz)
-            if start_time.date() in weather:
+    probabilities = ProbabilityIndex.from_data(data)
+    lookups = 0
+    for interval in parse_intervals(amounts):
+        if interval.value > 0:
+            day = get_local_date(interval.start, tz)
+            if day in weather:
                 # Find probability of snowfall for this given duration
+                lookups += 1
                 probability = get_probability_for_duration(
-                    datetime_str, start_time, duration, data, tz
+                    probabilities, interval.start, interval.duration
                 )
-                if probability >= PROBABILITY_THRESHOLD:
-                    weather[start_time.date()] += amount["value"]
+                if probability >= threshold:
+                    weather[day] += interval.value
+    metrics.count("snowfall_entries", len(amounts))
+    metrics.count("probability_lookups", lookups)
     return weather
 
 
-def get_stored_snow_data():
-    stored = None
+def parse_snow_data_thresholds(data, date_range, tz_name, thresholds):
+    """Parse a forecast for several probability thresholds. Returns {threshold:
+    forecast}. A sweep over enough thresholds is parsed once, through the Timeline;
+    fewer are quicker parsed one at a time."""
+    from pytz import timezone
+
+    Timeline = get_timeline()
+    if Timeline is None or len(thresholds) < TIMELINE_MIN_THRESHOLDS:
+        return {
+            threshold: parse_snow_data(data, date_range, tz_name, threshold)
+            for threshold in thresholds
+        }
+    tz = timezone(tz_name)
+    # Every snowfall entry gets its probability looked up at once
+    num_entries = len(data["snowfallAmount"]["values"])
+    metrics.count("snowfall_entries", num_entries)
+    metrics.count("probability_lookups", num_entries)
+    totals = Timeline(data, tz).daily_totals(date_range, thresholds)
+    return {
+        threshold: {d: float(total) for d, total in zip(date_range, row)}
+        for threshold, row in zip(thresholds, totals)
+    }
+
+
+def get_incremental_forecast(location):
+    """Return a location's last parsed forecast, or None if there isn't one that was
+    parsed the same way."""
+    from scripts.incremental import IncrementalForecast
+
+    forecast = _incremental_forecasts.get(location["name"])
+    if forecast is None:
+        stored = store.get_intervals(location["name"])
+        if stored and stored[:2] == (location["timezone"], PROBABILITY_THRESHOLD):
+            forecast = IncrementalForecast.from_rows(*stored)
+    return forecast
+
+
+def parse_snow_data_incremental(location, data, date_range):
+    """Like parse_snow_data, but only recompute the snowfall intervals that changed
+    since the location's last forecast, and store the changes for next time."""
+    from scripts.incremental import IncrementalForecast
+
+    forecast = get_incremental_forecast(location)
+    replace = forecast is None
+    if replace:
+        forecast = IncrementalForecast(location["timezone"])
+    metrics.count("snowfall_entries", len(data["snowfallAmount"]["values"]))
     try:
-        with open(os.path.join(__location__, "..", "data/weather.json"), "r") as f:
-            stored = json.load(f)
-    finally:
-        return stored
+        upserts, removed = forecast.update(data)
+        store.save_intervals(
+            location["name"],
+            forecast.tz_name,
+            forecast.threshold,
+            upserts,
+            removed,
+            replace,
+        )
+    except Exception:
+        # Start from what's stored next time, rather than from changes that weren't
+        # stored
+        _incremental_forecasts.pop(location["name"], None)
+        raise
+    _incremental_forecasts[location["name"]] = forecast
+    return forecast.get_forecast(date_range)
+
+
+def get_stored_snow_data(location, before=None):
+    """Return the most recently stored forecast for a location, or the most recent
+    one stored at or before a given timestamp."""
+    return store.get_forecast(location["name"], before)
 
 
 def diff_forecasts(current_forecast, prev_forecast, date_range):
@@ -90,9 +241,12 @@ def diff_forecasts(current_forecast, prev_forecast, date_range):
     return diff
 
 
-def make_forecast_sentences(diff, date_range):
+def make_forecast_sentences(diff, date_range, suppress_under=LESS_THAN_AN_INCH):
+    """Describe the forecast for each day in the diff, or return [] if nothing has
+    changed. A change between two amounts that are both under suppress_under (in mm)
+    doesn't count, since they'd both be "<1 in." anyway; 0 counts every change."""
     if not diff:
-        return
+        return []
     has_changed_forecast = False
     sentences = []
     for d in date_range:
@@ -100,7 +254,10 @@ def make_forecast_sentences(diff, date_range):
             if (
                 "old" in diff[d]
                 and diff[d]["new"] != diff[d]["old"]
-                and not (0 < diff[d]["new"] < 25.4 and 0 < diff[d]["old"] < 25.4)
+                and not (
+                    0 < diff[d]["new"] < suppress_under
+                    and 0 < diff[d]["old"] < suppress_under
+                )
             ):
                 has_changed_forecast = True
                 sentences.append(
@@ -124,9 +281,5 @@ def make_forecast_sentences(diff, date_range):
     return sentences if has_changed_forecast else []
 
 
-def store_forecast(current_forecast):
-    forecast_to_store = {}
-    for key, val in current_forecast.items():
-        forecast_to_store[key.isoformat()] = val
-    with open(os.path.join(__location__, "..", "data/weather.json"), "w") as f:
-        json.dump(forecast_to_store, f, indent=2)
+def serialize_forecast(current_forecast):
+    return {key.isoformat(): val for key, val in current_forecast.items()}
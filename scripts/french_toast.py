@@ -18,17 +18,34 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import json
 import re
+from scripts import http_cache, store
 from scripts.utils import *
 
 FRENCH_TOAST_URL = "http://universalhub.com/toast.xml"
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
 
-def fetch_french_toast():
-    """Fetch french toast level from Universal Hub."""
-    toast = fetch(FRENCH_TOAST_URL)
+def fetch_french_toast(stored_level=None, deadline=None):
+    """Fetch french toast level from Universal Hub. If the feed hasn't changed since
+    it was last fetched, or can't be fetched by the deadline, the stored level is
+    kept. Returns the level, and a function to call once it has been stored, which
+    updates the HTTP cache (or None if there's nothing to update). Until then, the
+    feed is treated as unchanged from the stored level."""
+    resp = get(
+        FRENCH_TOAST_URL,
+        conditional=stored_level is not None,
+        update_cache=False,
+        deadline=deadline,
+    )
+    if resp is None or resp is NOT_MODIFIED:
+        return stored_level, None
+    level = parse_french_toast(resp.text)
+    return level, lambda: http_cache.store_entry(FRENCH_TOAST_URL, resp.headers)
+
+
+def parse_french_toast(toast):
+    """Return the level from the french toast feed, or None if it doesn't have one."""
     m = re.search(r"<status>(?:.*?-\s)?(.*?)</status>", toast)
     if m:
         level = m.group(1)
@@ -36,15 +53,6 @@ def fetch_french_toast():
     return None
 
 
-def get_stored_toast_data():
-    stored = None
-    try:
-        with open(os.path.join(__location__, "..", "data/toast.json"), "r") as f:
-            stored = json.load(f)
-    finally:
-        return stored
-
-
 def make_french_toast_emojis(current):
     french_toast_emojis = " ".join(["🍞", "🥛", "🥚"])
     emojis = ""
@@ -75,24 +83,20 @@ def make_french_toast_sentence(current, stored):
     return None
 
 
-def store_french_toast(current, gif_last_tweeted):
-    toast_to_store = {"level": current, "gif_last_tweeted": gif_last_tweeted}
-    with open(os.path.join(__location__, "..", "data/toast.json"), "w") as f:
-        json.dump(toast_to_store, f, indent=2)
-
-
-def get_french_toast(dry_run):
-    toast = fetch_french_toast()
-    stored_toast = get_stored_toast_data()
-    sentence = make_french_toast_sentence(
-        toast, stored_toast["level"] if stored_toast else None
-    )
+def get_french_toast(deadline=None):
+    """Return the current toast level and the sentence to tweet about it, along with
+    the (level, gif_last_tweeted) state to store for next time, and a function to call
+    once it has been stored (see fetch_french_toast)."""
+    stored_toast = store.get_toast()
+    stored_level = stored_toast["level"] if stored_toast else None
+    toast, update_cache = fetch_french_toast(stored_level, deadline)
+    sentence = make_french_toast_sentence(toast, stored_level)
     gif_last_tweeted = stored_toast["gif_last_tweeted"] if stored_toast else None
     should_tweet_gif = get_should_tweet_gif(toast, gif_last_tweeted)
-    if not dry_run:
-        store_french_toast(toast, time.time() if should_tweet_gif else gif_last_tweeted)
     return {
         "current_toast_level": toast,
         "sentence": sentence,
         "gif_last_tweeted": gif_last_tweeted,
+        "state": (toast, time.time() if should_tweet_gif else gif_last_tweeted),
+        "update_cache": update_cache,
     }
@@ -0,0 +1,104 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+# The parts of a gridpoint document the forecast uses, and the type each should be.
+# The rest of the document (dozens of other weather layers) is never decoded.
+GRIDPOINT_LAYERS = {
+    "updateTime": str,
+    "snowfallAmount": dict,
+    "probabilityOfPrecipitation": dict,
+}
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+
+def find_value(buffer, key, start):
+    """Find where the value for a key starts in a partial JSON document. Returns
+    (key position, value position), with a value position of None if the buffer ends
+    before the value starts, or (None, None) if the key isn't in the buffer. A quoted
+    string only counts as a key if it's followed by a colon."""
+    quoted = '"{}"'.format(key)
+    while True:
+        key_pos = buffer.find(quoted, start)
+        if key_pos == -1:
+            return None, None
+        pos = _whitespace.match(buffer, key_pos + len(quoted)).end()
+        if pos == len(buffer):
+            return key_pos, None
+        if buffer[pos] == ":":
+            pos = _whitespace.match(buffer, pos + 1).end()
+            return key_pos, pos if pos < len(buffer) else None
+        start = key_pos + 1
+
+
+def extract_layers(chunks, layers=GRIDPOINT_LAYERS):
+    """Read a JSON document from an iterable of byte chunks, and return {key: value}
+    for the first occurrence of each key in layers whose value has the expected type.
+
+    Only the values for those keys are decoded. Everything else is skipped over as
+    text, and dropped from memory as soon as it has been scanned. Reading stops as
+    soon as every key has been found, so the rest of the document is never
+    scanned. Raises ValueError if the document ends first."""
+    pending = dict(layers)
+    found = {}
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    # Keep enough of the end of the scanned text to find a key split across chunks
+    overlap = max(len(key) for key in layers) + 2
+    buffer = ""
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        start = 0
+        while pending:
+            earliest = None
+            for key in pending:
+                key_pos, value_pos = find_value(buffer, key, start)
+                if key_pos is not None and (earliest is None or key_pos < earliest[0]):
+                    earliest = (key_pos, value_pos, key)
+            if earliest is None:
+                # None of the keys are here, so forget everything but what could be
+                # the start of one
+                buffer = buffer[max(len(buffer) - overlap, start) :]
+                break
+            key_pos, value_pos, key = earliest
+            if value_pos is None:
+                # Wait for the value to start
+                buffer = buffer[key_pos:]
+                break
+            try:
+                # Objects and strings can't be decoded until they're complete, which
+                # is why the layers can't be numbers
+                value, end = _decoder.raw_decode(buffer, value_pos)
+            except json.JSONDecodeError:
+                # Wait for the rest of the value
+                buffer = buffer[key_pos:]
+                break
+            if isinstance(value, pending[key]):
+                found[key] = value
+                del pending[key]
+            start = end
+        if not pending:
+            return found
+    raise ValueError("Document ended without {}".format(", ".join(sorted(pending))))
@@ -0,0 +1,100 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from email.utils import parsedate_to_datetime
+import hashlib
+import json
+import os
+import re
+import time
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+# Only validators and freshness lifetimes are stored, not response bodies. A caller
+# that gets NOT_MODIFIED back already handled that body on a previous run.
+CACHE_DIR = os.path.join(__location__, "..", "data/http_cache")
+
+
+def get_cache_path(url):
+    return os.path.join(CACHE_DIR, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+
+def load_entry(url):
+    """Return the stored cache entry for a URL, or None if there isn't a usable one."""
+    try:
+        with open(get_cache_path(url), "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return entry if entry.get("url") == url else None
+
+
+def store_entry(url, headers, entry=None):
+    """Store the validators from a response's headers. For a 304 response, pass the
+    existing entry so that validators the server didn't resend are kept."""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control:
+        return
+    entry = {
+        "url": url,
+        "etag": headers.get("ETag") or (entry and entry["etag"]),
+        "last_modified": headers.get("Last-Modified")
+        or (entry and entry["last_modified"]),
+        "expires": get_expiry(headers),
+    }
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = get_cache_path(url)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def get_expiry(headers):
+    """Return the timestamp until which a response is fresh, per Cache-Control or
+    Expires. Returns 0 if it must always be revalidated."""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-cache" in cache_control:
+        return 0
+    now = parse_http_date(headers.get("Date")) or time.time()
+    m = re.search(r"(?:^|[,\s])max-age=(\d+)", cache_control)
+    if m:
+        return now + int(m.group(1))
+    expires = parse_http_date(headers.get("Expires"))
+    return expires or 0
+
+
+def is_fresh(entry):
+    return entry["expires"] > time.time()
+
+
+def get_conditional_headers(entry):
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
@@ -0,0 +1,191 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from bisect import bisect_left, insort
+from pytz import timezone
+
+from scripts.intervals import get_local_date, parse_valid_time
+from scripts.metrics import metrics
+from scripts.probability import ProbabilityIndex, get_probability_for_duration
+from scripts.utils import *
+
+SNOW = "snowfallAmount"
+PROBABILITY = "probabilityOfPrecipitation"
+
+
+def parse_span(valid_time):
+    """Return the (start, end) timestamps of a validTime."""
+    start, duration = parse_valid_time(valid_time)
+    return start, start + duration
+
+
+class IncrementalForecast:
+    """A location's last parsed forecast, kept as its raw intervals along with what
+    each snowfall interval contributed to its day's total. Updating it with a new
+    forecast only recomputes the snowfall intervals that changed, or whose
+    probability did, and only re-adds the days they fall on."""
+
+    def __init__(self, tz_name, threshold=PROBABILITY_THRESHOLD):
+        self.tz_name = tz_name
+        self.tz = timezone(tz_name)
+        self.threshold = threshold
+        # {layer: {validTime: (value, start, end)}}
+        self.intervals = {SNOW: {}, PROBABILITY: {}}
+        # {validTime: (day, amount counted toward it)} for each snowfall interval
+        self.contributions = {}
+        # Snowfall intervals as sorted (start, validTime), to find the ones a changed
+        # probability overlaps
+        self.snow_starts = []
+        self.max_snow_duration = 0
+        self.index = ProbabilityIndex([])
+        self.days = {}  # {day: {validTime: (start, amount)}}
+        self.totals = {}  # {day: total}
+
+    @classmethod
+    def from_rows(cls, tz_name, threshold, rows):
+        """Restore a forecast from stored (layer, validTime, value, start, end, day,
+        amount) rows, without reparsing them."""
+        forecast = cls(tz_name, threshold)
+        snow = forecast.intervals[SNOW]
+        for layer, valid_time, value, start, end, day, amount in rows:
+            forecast.intervals[layer][valid_time] = (value, start, end)
+            if layer == PROBABILITY:
+                forecast.index.add(start, end, value)
+            else:
+                forecast.contributions[valid_time] = (day, amount)
+        forecast.snow_starts = sorted((x[1], vt) for vt, x in snow.items())
+        forecast.max_snow_duration = max(
+            (end - start for _, start, end in snow.values()), default=0
+        )
+        for valid_time, (day, amount) in forecast.contributions.items():
+            forecast.days.setdefault(day, {})[valid_time] = (
+                snow[valid_time][1],
+                amount,
+            )
+        forecast.add_days(forecast.days.keys())
+        return forecast
+
+    def add_days(self, days):
+        """Recompute the totals for days, adding their contributions in time order,
+        the same order a full parse would add them in."""
+        for day in days:
+            entries = self.days.get(day)
+            if entries:
+                self.totals[day] = sum(
+                    amount for _, amount in sorted(entries.values()) if amount
+                )
+            else:
+                self.days.pop(day, None)
+                self.totals.pop(day, None)
+
+    def get_changes(self, layer, values):
+        """Return ({validTime: value} added or changed, {validTime} removed) between
+        the stored intervals of a layer and a new series."""
+        stored = self.intervals[layer]
+        new = {x["validTime"]: x["value"] for x in values}
+        changed = {
+            vt: value
+            for vt, value in new.items()
+            if vt not in stored or stored[vt][0] != value
+        }
+        removed = stored.keys() - new.keys()
+        return changed, removed
+
+    def overlapping_snow(self, start, end):
+        """Return the validTimes of snowfall intervals that overlap [start, end)."""
+        lo = bisect_left(self.snow_starts, (start - self.max_snow_duration,))
+        hi = bisect_left(self.snow_starts, (end,))
+        snow = self.intervals[SNOW]
+        return {vt for _, vt in self.snow_starts[lo:hi] if snow[vt][2] > start}
+
+    def get_contribution(self, valid_time):
+        value, start, end = self.intervals[SNOW][valid_time]
+        day = get_local_date(start, self.tz).isoformat()
+        if not value or value <= 0:
+            return day, 0
+        probability = get_probability_for_duration(self.index, start, end - start)
+        return day, value if probability >= self.threshold else 0
+
+    def update(self, data):
+        """Bring the forecast up to date with a new gridpoint forecast. Returns the
+        changes to store, as (upserted rows, removed (layer, validTime) pairs); see
+        from_rows for the row format."""
+        snow_changed, snow_removed = self.get_changes(SNOW, data[SNOW]["values"])
+        pop_changed, pop_removed = self.get_changes(
+            PROBABILITY, data[PROBABILITY]["values"]
+        )
+        upserts = []
+        removed = [(SNOW, vt) for vt in snow_removed] + [
+            (PROBABILITY, vt) for vt in pop_removed
+        ]
+
+        # Update the probability index, and find the snowfall intervals it affects
+        recompute = set(snow_changed)
+        pop = self.intervals[PROBABILITY]
+        for valid_time in pop_removed | pop_changed.keys():
+            if valid_time in pop:
+                value, start, end = pop.pop(valid_time)
+                self.index.remove(start, end, value)
+                recompute |= self.overlapping_snow(start, end)
+        for valid_time, value in pop_changed.items():
+            start, end = parse_span(valid_time)
+            pop[valid_time] = (value, start, end)
+            self.index.add(start, end, value)
+            recompute |= self.overlapping_snow(start, end)
+            upserts.append((PROBABILITY, valid_time, value, start, end, None, None))
+
+        # Drop removed and changed snowfall intervals, then add the new ones
+        snow = self.intervals[SNOW]
+        touched_days = set()
+        for valid_time in snow_removed | snow_changed.keys():
+            if valid_time in snow:
+                _, start, _ = snow.pop(valid_time)
+                self.snow_starts.remove((start, valid_time))
+                day, _ = self.contributions.pop(valid_time)
+                del self.days[day][valid_time]
+                touched_days.add(day)
+        for valid_time, value in snow_changed.items():
+            start, end = parse_span(valid_time)
+            snow[valid_time] = (value, start, end)
+            insort(self.snow_starts, (start, valid_time))
+            self.max_snow_duration = max(self.max_snow_duration, end - start)
+
+        recompute -= snow_removed
+        for valid_time in recompute:
+            value, start, end = snow[valid_time]
+            day, amount = self.get_contribution(valid_time)
+            old = self.contributions.get(valid_time)
+            if old:
+                del self.days[old[0]][valid_time]
+                touched_days.add(old[0])
+            self.contributions[valid_time] = (day, amount)
+            self.days.setdefault(day, {})[valid_time] = (start, amount)
+            touched_days.add(day)
+            upserts.append((SNOW, valid_time, value, start, end, day, amount))
+        self.add_days(touched_days)
+        metrics.count("intervals_changed", len(snow_changed) + len(pop_changed))
+        metrics.count("intervals_removed", len(removed))
+        metrics.count("probability_lookups", len(recompute))
+        return upserts, removed
+
+    def get_forecast(self, date_range):
+        """Return {date: total snowfall} for each date in the range."""
+        return {d: self.totals.get(d.isoformat(), 0) for d in date_range}
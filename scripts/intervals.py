@@ -0,0 +1,97 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from datetime import datetime
+from functools import lru_cache
+import re
+
+HOUR = 60 * 60
+# Neighbouring grid cells, and successive forecasts for the same one, mostly share
+# their validTimes, so a few thousand covers every location's series several times over
+VALID_TIME_CACHE_SIZE = 4096
+# Years and months aren't a fixed length, and the API doesn't use them
+DURATION_PATTERN = re.compile(
+    r"P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?"
+)
+DURATION_SECONDS = {
+    "weeks": 7 * 24 * HOUR,
+    "days": 24 * HOUR,
+    "hours": HOUR,
+    "minutes": 60,
+    "seconds": 1,
+}
+
+
+class Interval:
+    """One entry in a gridpoint series: its start timestamp, its duration in seconds,
+    and its value."""
+
+    __slots__ = ("start", "duration", "value")
+
+    def __init__(self, start, duration, value):
+        self.start = start
+        self.duration = duration
+        self.value = value
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def __repr__(self):
+        return "Interval({!r}, {!r}, {!r})".format(
+            self.start, self.duration, self.value
+        )
+
+
+def parse_duration(duration):
+    """Return the length of an ISO 8601 duration, like "PT6H" or "P1DT6H", in
+    seconds."""
+    m = DURATION_PATTERN.fullmatch(duration)
+    if not m or duration in ("P", "PT") or duration.endswith("T"):
+        raise ValueError("Unsupported duration: {}".format(duration))
+    return sum(
+        int(amount) * DURATION_SECONDS[unit]
+        for unit, amount in m.groupdict().items()
+        if amount
+    )
+
+
+@lru_cache(maxsize=VALID_TIME_CACHE_SIZE)
+def parse_valid_time(valid_time):
+    """Return the (start timestamp, duration in seconds) of a validTime, an ISO 8601
+    interval given as a start time and either a duration or an end time. Results
+    are cached, and shared by every location."""
+    start_str, _, rest = valid_time.partition("/")
+    start = datetime.fromisoformat(start_str).timestamp()
+    if rest.startswith("P"):
+        return start, parse_duration(rest)
+    return start, datetime.fromisoformat(rest).timestamp() - start
+
+
+@lru_cache(maxsize=VALID_TIME_CACHE_SIZE)
+def get_local_date(timestamp, tz):
+    """Return the date a timestamp falls on in a timezone."""
+    return datetime.fromtimestamp(timestamp, tz).date()
+
+
+def parse_intervals(values):
+    """Parse a series from a gridpoint forecast into Intervals, in the same order."""
+    return [Interval(*parse_valid_time(x["validTime"]), x["value"]) for x in values]
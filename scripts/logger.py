@@ -0,0 +1,155 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from datetime import datetime
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from config import *
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+LOG_PATH = os.path.join(__location__, "..", "snowbot.log")
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+# Write early if this many records are waiting, rather than holding them all until
+# the next flush
+MAX_BUFFERED = 1000
+
+
+class Logger:
+    """Writes log records to a file as JSON lines. Records are buffered and written
+    by a background thread, so logging never waits on the disk. Each record has the
+    ID of the run it was logged during, so that the records from one run can be
+    picked out of a daemon's log. The file is rotated once it gets too big."""
+
+    def __init__(
+        self,
+        path=LOG_PATH,
+        level=LOG_LEVEL,
+        max_bytes=LOG_MAX_BYTES,
+        backups=LOG_BACKUPS,
+        flush_interval=LOG_FLUSH_INTERVAL,
+    ):
+        self.path = path
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.run_id = None
+        self.reset()
+        # A forked worker process gets a copy of the buffer and locks, but not the
+        # writer thread. Start afresh, so that it doesn't write the parent's records
+        # too, or wait on a lock that the parent's thread held.
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.buffer = []
+        self.lock = threading.Lock()
+        # Held while writing, so that records from two flushes can't interleave
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start_run(self):
+        """Start a new run, and return its ID."""
+        self.run_id = os.urandom(6).hex()
+        return self.run_id
+
+    def log(self, message, level="info", **fields):
+        """Queue a record to be written, unless it's below the logger's level. Any
+        fields are written alongside the message."""
+        if LEVELS[level] < LEVELS[self.level]:
+            return
+        with self.lock:
+            self.buffer.append((time.time(), level, self.run_id, message, fields))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="logger", daemon=True
+                )
+                self.thread.start()
+            full = len(self.buffer) >= MAX_BUFFERED
+        if full:
+            self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every queued record."""
+        with self.write_lock:
+            with self.lock:
+                records, self.buffer = self.buffer, []
+            if not records:
+                return
+            lines = "".join(
+                json.dumps(
+                    {
+                        "time": datetime.fromtimestamp(timestamp)
+                        .astimezone()
+                        .isoformat(timespec="milliseconds"),
+                        "level": level,
+                        "run": run_id,
+                        "message": message,
+                        **fields,
+                    },
+                    ensure_ascii=False,
+                    default=str,
+                )
+                + "\n"
+                for timestamp, level, run_id, message, fields in records
+            ).encode("utf-8")
+            try:
+                self.rotate(len(lines))
+                with open(self.path, "ab") as f:
+                    f.write(lines)
+            except OSError as e:
+                # There's nowhere else to log to, and losing log records shouldn't
+                # stop the bot
+                sys.stderr.write(
+                    "Couldn't write {} log records: {!r}\n".format(len(records), e)
+                )
+
+    def rotate(self, incoming):
+        """Move the log to <path>.1 (and <path>.1 to <path>.2, and so on, dropping
+        the oldest) if writing incoming bytes to it would make it too big."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size == 0 or size + incoming <= self.max_bytes:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            backup = "{}.{}".format(self.path, i)
+            if os.path.exists(backup):
+                os.replace(backup, "{}.{}".format(self.path, i + 1))
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+
+
+# Shared by everything in the process
+logger = Logger()
+atexit.register(logger.flush)
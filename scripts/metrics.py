@@ -0,0 +1,229 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    """Timings and counts for a single run. Stages can run on several threads at once,
+    so their CPU time is measured per thread and summed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.start_wall = time.perf_counter()
+            self.start_cpu = time.process_time()
+            self.stages = defaultdict(lambda: {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            self.counts = defaultdict(int)
+            self.hosts = defaultdict(
+                lambda: {"requests": 0, "errors": 0, "bytes": 0, "latency": 0.0}
+            )
+            self.max_latency = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of code as part of a stage. Stages may be nested, in which
+        case the inner stage's time is included in the outer one's too."""
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            with self.lock:
+                stage = self.stages[name]
+                stage["wall"] += wall
+                stage["cpu"] += cpu
+                stage["calls"] += 1
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    def record_request(self, host, seconds, num_bytes=0, error=False):
+        with self.lock:
+            stats = self.hosts[host]
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["bytes"] += num_bytes
+            stats["latency"] += seconds
+            self.max_latency[host] = max(self.max_latency[host], seconds)
+
+    def record_bytes(self, host, num_bytes):
+        """Count the bytes of a streamed response, once they have been read; its
+        request was recorded when the headers arrived."""
+        with self.lock:
+            self.hosts[host]["bytes"] += num_bytes
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "wall": time.perf_counter() - self.start_wall,
+                "cpu": time.process_time() - self.start_cpu,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counts": dict(self.counts),
+                "hosts": {
+                    host: {**stats, "max_latency": self.max_latency[host]}
+                    for host, stats in self.hosts.items()
+                },
+            }
+
+    def to_prometheus(self):
+        """Format the metrics for the node_exporter textfile collector."""
+        data = self.to_dict()
+        lines = []
+
+        def add(name, help_text, samples):
+            lines.append("# HELP snowbot_{} {}".format(name, help_text))
+            lines.append("# TYPE snowbot_{} gauge".format(name))
+            for labels, value in samples:
+                label_str = ",".join(
+                    '{}="{}"'.format(key, val) for key, val in labels.items()
+                )
+                lines.append(
+                    "snowbot_{}{} {}".format(
+                        name, "{" + label_str + "}" if label_str else "", value
+                    )
+                )
+
+        add(
+            "last_run_timestamp_seconds",
+            "When the last run started.",
+            [({}, data["started_at"])],
+        )
+        add("run_wall_seconds", "Wall time of the last run.", [({}, data["wall"])])
+        add("run_cpu_seconds", "Process CPU time of the last run.", [({}, data["cpu"])])
+        stages = data["stages"].items()
+        add(
+            "stage_wall_seconds",
+            "Wall time spent in each stage of the last run.",
+            [({"stage": name}, stage["wall"]) for name, stage in stages],
+        )
+        add(
+            "stage_cpu_seconds",
+            "CPU time spent in each stage of the last run.",
+            [({"stage": name}, stage["cpu"]) for name, stage in stages],
+        )
+        add(
+            "stage_calls",
+            "Number of times each stage ran in the last run.",
+            [({"stage": name}, stage["calls"]) for name, stage in stages],
+        )
+        add(
+            "events",
+            "Number of times each counted event happened in the last run.",
+            [({"event": name}, n) for name, n in data["counts"].items()],
+        )
+        hosts = data["hosts"].items()
+        for key, name, help_text in [
+            (
+                "requests",
+                "requests",
+                "HTTP requests made to each host in the last run.",
+            ),
+            ("errors", "errors", "Failed HTTP requests to each host in the last run."),
+            ("bytes", "bytes", "HTTP response bytes from each host in the last run."),
+            (
+                "latency",
+                "latency_seconds",
+                "Total HTTP latency to each host in the last run.",
+            ),
+            (
+                "max_latency",
+                "max_latency_seconds",
+                "Slowest HTTP request to each host in the last run.",
+            ),
+        ]:
+            add(
+                "http_" + name,
+                help_text,
+                [({"host": host}, stats[key]) for host, stats in hosts],
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to a file, as a Prometheus textfile if its name ends in
+        .prom and as JSON otherwise. The file is replaced atomically, so a collector
+        never sees a partial one."""
+        if path.endswith(".prom"):
+            contents = self.to_prometheus()
+        else:
+            contents = json.dumps(self.to_dict(), indent=2)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+
+
+class Profiler:
+    """Collects cProfile stats from every thread that runs a call through it, since
+    before Python 3.12 cProfile only sees the thread it was started in. Each call's
+    stats are merged into the running total as soon as it returns, so a daemon
+    profiling every poll doesn't hold on to every poll's profile."""
+
+    def __init__(self):
+        self.stats = None
+        self.lock = threading.Lock()
+
+    def runcall(self, func, *args, **kwargs):
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # From Python 3.12 only one profiler can be active at a time, but it sees
+            # every thread, so a call made while another is active is already
+            # being profiled
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            self.add(profile)
+
+    def add(self, profile):
+        import pstats
+
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def dump(self, path):
+        with self.lock:
+            if self.stats is not None:
+                self.stats.dump_stats(path)
+
+
+# Shared by everything in the process
+metrics = Metrics()
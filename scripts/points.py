@@ -0,0 +1,98 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from scripts import store
+from scripts.metrics import metrics
+from scripts.utils import *
+
+POINTS_API_URL = "https://api.weather.gov/points/{latitude},{longitude}"
+
+
+def round_coordinate(value):
+    # The API redirects requests for more than 4 decimal places, and a grid cell is
+    # 2.5 km across, so more precision wouldn't change the answer anyway
+    return round(float(value), 4)
+
+
+def fetch_point(latitude, longitude):
+    """Look up the forecast office, grid coordinates, and timezone for a point.
+    Returns None if the lookup fails."""
+    resp = fetch(
+        POINTS_API_URL.format(latitude=latitude, longitude=longitude), is_json=True
+    )
+    if resp is None:
+        return None
+    try:
+        properties = resp["properties"]
+        return {
+            "office": properties["gridId"],
+            "grid_x": properties["gridX"],
+            "grid_y": properties["gridY"],
+            "timezone": properties["timeZone"],
+        }
+    except (KeyError, TypeError):
+        log(
+            "Unexpected response for point {},{}".format(latitude, longitude),
+            "warning",
+        )
+        return None
+
+
+def resolve_location(location, ttl=POINTS_CACHE_TTL):
+    """Fill in the office, grid coordinates, and timezone of a location given by
+    latitude and longitude, from the points cache if it has a fresh entry. If the
+    lookup fails, a stale entry is used rather than none. Returns None if the
+    location can't be resolved at all. Locations given by grid are returned as is."""
+    if "office" in location:
+        return location
+    latitude = round_coordinate(location["latitude"])
+    longitude = round_coordinate(location["longitude"])
+    cached = store.get_point(latitude, longitude)
+    if cached and time.time() - cached["fetched_at"] < ttl:
+        point = cached
+    else:
+        metrics.count("point_lookups")
+        point = fetch_point(latitude, longitude)
+        if point:
+            store.save_point(latitude, longitude, point)
+        elif cached:
+            log("Using stale grid for {}.".format(location["name"]), "warning")
+            point = cached
+        else:
+            log(
+                "Couldn't find the grid for {}; skipping it.".format(location["name"]),
+                "warning",
+            )
+            return None
+    resolved = {
+        "office": point["office"],
+        "grid_x": point["grid_x"],
+        "grid_y": point["grid_y"],
+        "timezone": point["timezone"],
+    }
+    # A location's own timezone wins over the grid's
+    resolved.update(location)
+    return resolved
+
+
+def resolve_locations(locations):
+    """Resolve every location (see resolve_location), dropping any that can't be."""
+    resolved = [resolve_location(location) for location in locations]
+    return [location for location in resolved if location is not None]
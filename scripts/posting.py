@@ -0,0 +1,200 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+from scripts import store
+from scripts.utils import *
+
+# How long to assume a rate limit lasts if Twitter doesn't say
+DEFAULT_RATE_LIMIT_WINDOW = 15 * 60
+
+
+class PostError(Exception):
+    """A post that didn't go through. If it's retryable, retry_at may say when."""
+
+    def __init__(self, reason, retryable, retry_at=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retryable = retryable
+        self.retry_at = retry_at
+
+
+class TwitterClient:
+    """Authenticated connection to the Twitter API for one account, which keeps
+    track of the account's rate limit for posting."""
+
+    def __init__(self, credentials, api_url=POSTING_API_URL, timeout=POSTING_TIMEOUT):
+        # Only loaded once there's something to post
+        from requests_oauthlib import OAuth1Session
+
+        self.api_url = api_url
+        self.timeout = timeout
+        self.session = OAuth1Session(
+            credentials["consumer_api_key"],
+            client_secret=credentials["consumer_api_secret"],
+            resource_owner_key=credentials["access_token"],
+            resource_owner_secret=credentials["access_key"],
+        )
+        self.session.headers.update(HEADERS)
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+
+    def get_rate_limit_wait(self):
+        """Seconds until the account can post again, or 0 if it can now."""
+        if self.rate_limit_remaining == 0 and self.rate_limit_reset:
+            return max(self.rate_limit_reset - time.time(), 0)
+        return 0
+
+    def update_rate_limit(self, resp):
+        remaining = resp.headers.get("x-rate-limit-remaining")
+        reset = resp.headers.get("x-rate-limit-reset")
+        if remaining is not None:
+            self.rate_limit_remaining = int(remaining)
+        if reset is not None:
+            self.rate_limit_reset = int(reset)
+
+    def post(self, text, in_reply_to=None):
+        """Post a tweet, optionally as a reply. Returns the new tweet's ID."""
+        import requests
+
+        data = {"status": text}
+        if in_reply_to:
+            data["in_reply_to_status_id"] = in_reply_to
+            data["auto_populate_reply_metadata"] = "true"
+        try:
+            resp = self.session.post(
+                self.api_url + "/statuses/update.json", data=data, timeout=self.timeout
+            )
+        except requests.exceptions.RequestException as e:
+            raise PostError(repr(e), retryable=True)
+        self.update_rate_limit(resp)
+        if resp.status_code == 429:
+            self.rate_limit_remaining = 0
+            if not self.rate_limit_reset or self.rate_limit_reset < time.time():
+                self.rate_limit_reset = time.time() + DEFAULT_RATE_LIMIT_WINDOW
+            raise PostError(
+                "Rate limited", retryable=True, retry_at=self.rate_limit_reset
+            )
+        if resp.status_code >= 500:
+            raise PostError("HTTP {}".format(resp.status_code), retryable=True)
+        if not resp.ok:
+            # Duplicate tweets, suspended accounts, bad credentials, etc. won't be
+            # fixed by trying again
+            raise PostError(
+                "HTTP {}: {}".format(resp.status_code, resp.text[:200]),
+                retryable=False,
+            )
+        return resp.json()["id_str"]
+
+
+class PostingQueue:
+    """Posts queued threads, one worker per account, so that a slow or rate-limited
+    account doesn't hold up the others. Posts that don't go through stay queued in
+    the database and are retried with backoff on later runs. Each queue only posts
+    the threads queued under its own name, so sinks don't post each other's."""
+
+    def __init__(self, name, accounts, api_url=POSTING_API_URL):
+        self.name = name
+        self.accounts = accounts
+        self.api_url = api_url
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get_client(self, account):
+        with self.lock:
+            if account not in self.clients:
+                self.clients[account] = TwitterClient(
+                    self.accounts[account], self.api_url
+                )
+            return self.clients[account]
+
+    def enqueue(self, account, tweets):
+        return store.enqueue_thread(self.name, account, tweets)
+
+    def drain(self, timeout=POSTING_DEADLINE):
+        """Post everything that's due, in parallel across accounts, giving up on
+        waiting after timeout seconds. Anything not posted by then is left queued."""
+        accounts = store.get_pending_accounts(self.name)
+        if not accounts:
+            return
+        deadline = time.time() + timeout
+        executor = ThreadPoolExecutor(max_workers=len(accounts))
+        futures = [
+            executor.submit(self.drain_account, account, deadline)
+            for account in accounts
+        ]
+        wait(futures, timeout=timeout)
+        # Workers stop on their own at the deadline; don't wait on any that are stuck
+        # in a request
+        executor.shutdown(wait=False)
+        for future in futures:
+            if future.done() and future.exception():
+                log("Posting failed: {!r}".format(future.exception()), "error")
+
+    def drain_account(self, account, deadline):
+        if account not in self.accounts:
+            log(
+                "No credentials for account {}; leaving its posts queued.".format(
+                    account
+                ),
+                "error",
+            )
+            return
+        client = self.get_client(account)
+        while time.time() < deadline:
+            posts = store.get_next_posts(self.name, account)
+            if not posts:
+                return
+            due = [post for post in posts if post[3] <= time.time()]
+            if not due:
+                # Everything left is waiting for a backoff or rate limit to end. Wait
+                # for the first of them if it ends in time, otherwise try on a later run
+                next_attempt_at = min(post[3] for post in posts)
+                if next_attempt_at >= deadline:
+                    return
+                time.sleep(next_attempt_at - time.time())
+                continue
+            for post_id, text, attempts, _, in_reply_to in due:
+                rate_limit_wait = client.get_rate_limit_wait()
+                if time.time() + rate_limit_wait >= deadline:
+                    log("Rate limited on {}; posting later.".format(account), "warning")
+                    return
+                time.sleep(rate_limit_wait)
+                self.send(client, account, post_id, text, attempts, in_reply_to)
+
+    def send(self, client, account, post_id, text, attempts, in_reply_to):
+        try:
+            tweet_id = client.post(text, in_reply_to)
+        except PostError as e:
+            if e.retryable and attempts + 1 < POSTING_RETRIES:
+                retry_at = e.retry_at or time.time() + POSTING_BACKOFF * 2**attempts
+                store.mark_post_retry(post_id, retry_at, e.reason)
+                log(
+                    "Failed to tweet from {}, will retry: {}".format(account, e.reason),
+                    "warning",
+                )
+            else:
+                store.mark_post_failed(post_id, e.reason)
+                log("Failed to tweet from {}: {}".format(account, e.reason), "error")
+        else:
+            store.mark_post_sent(post_id, tweet_id)
+            log('Tweeted from {}: "{}"'.format(account, text))
@@ -18,113 +18,88 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from datetime import date, timedelta
+from bisect import bisect_left, bisect_right
+from scripts.intervals import parse_valid_time
 from scripts.utils import *
 
 
-def get_aggregate_probability(
-    target_datetime_str,
-    target_start_time,
-    target_duration,
-    data,
-    tz,
-    start_ind,
-    start_duration=None,
-):
-    """For target time ranges that span multiple entries in the dataset, get an
-    aggregate probability from all entries that apply."""
-    target_duration_int = get_duration_as_int(target_duration)
-    if start_duration is None:
-        _, dur = parse_duration_string(
-            data["probabilityOfPrecipitation"]["values"][start_ind]["validTime"]
+class ProbabilityIndex:
+    """Precipitation probabilities parsed once into sorted interval arrays, so that
+    lookups for each snowfall entry can bisect rather than rescan the series."""
+
+    def __init__(self, values):
+        intervals = []
+        for x in values:
+            start, duration = parse_valid_time(x["validTime"])
+            intervals.append((start, start + duration, x["value"]))
+        intervals.sort()
+        self.starts = [x[0] for x in intervals]
+        self.ends = [x[1] for x in intervals]
+        self.values = [x[2] for x in intervals]
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(data["probabilityOfPrecipitation"]["values"])
+
+    def add(self, start, end, value):
+        """Insert a period, keeping the arrays sorted."""
+        ind = bisect_right(self.starts, start)
+        self.starts.insert(ind, start)
+        self.ends.insert(ind, end)
+        self.values.insert(ind, value)
+
+    def remove(self, start, end, value):
+        ind = bisect_left(self.starts, start)
+        while (self.ends[ind], self.values[ind]) != (end, value):
+            ind += 1
+        del self.starts[ind], self.ends[ind], self.values[ind]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, timestamp):
+        """Return the index of the period containing the timestamp, or None."""
+        ind = bisect_right(self.starts, timestamp) - 1
+        if ind >= 0 and timestamp < self.ends[ind]:
+            return ind
+        return None
+
+    def window(self, start, end):
+        """Return the index range of periods that overlap [start, end)."""
+        return max(bisect_right(self.starts, start) - 1, 0), bisect_left(
+            self.starts, end
         )
-        start_duration = get_duration_as_int(dur)
-    total_duration = start_duration
-    probabilities = [
-        {
-            "numeric_duration": start_duration,
-            "probability": data["probabilityOfPrecipitation"]["values"][start_ind][
-                "value"
-            ],
-        }
-    ]
-    ind = start_ind + 1
 
-    # Gather all probabilities that apply to the target time range
-    while total_duration < target_duration_int:
-        x = data["probabilityOfPrecipitation"]["values"][ind]
-        start, duration = parse_duration_string(x["validTime"])
-        duration_int = get_duration_as_int(duration)
-        probabilities.append(
-            {
-                "numeric_duration": duration_int,
-                "probability": data["probabilityOfPrecipitation"]["values"][start_ind][
-                    "value"
-                ],
-            }
+
+def get_aggregate_probability(index, target_start, target_duration, start_ind):
+    """For target time ranges that span multiple entries in the dataset, get an
+    aggregate probability from all entries that apply, weighted by how much of the
+    target range each one covers."""
+    target_end = target_start + target_duration
+    _, end_ind = index.window(target_start, target_end)
+    weighted_sum = 0
+    total_duration = 0
+    for ind in range(start_ind, end_ind):
+        overlap = min(index.ends[ind], target_end) - max(
+            index.starts[ind], target_start
         )
-        ind += 1
-    aggregate_probability = sum(
-        [x["probability"] * x["numeric_duration"] for x in probabilities]
-    ) / sum([x["numeric_duration"] for x in probabilities])
-    return aggregate_probability
+        if overlap > 0:
+            weighted_sum += index.values[ind] * overlap
+            total_duration += overlap
+    return weighted_sum / total_duration
 
 
-def get_probability_for_duration(
-    target_datetime_str, target_start_time, target_duration, data, tz
-):
-    """Find the probability of snowfall corresponding to a snowfall amount time range"""
-    target_duration_int = get_duration_as_int(target_duration)
-    prev_ind, prev_x = None, None
-    for ind, x in enumerate(data["probabilityOfPrecipitation"]["values"]):
-        curr_start, curr_duration = parse_duration_string(x["validTime"])
-        if curr_start == target_datetime_str and curr_duration == target_duration:
-            # Exact match, return probability
-            return x["value"]
-        elif curr_start == target_datetime_str:
-            # Start time matches, but duration is different
-            curr_duration_int = get_duration_as_int(curr_duration)
-            if curr_duration_int > target_duration_int:
-                # This duration is greater than the target, so we can just use it
-                # directly
-                return x["value"]
-            else:
-                # This duration is less than the target, so we need to combine multiple
-                # entries to get an aggregate probability
-                return get_aggregate_probability(
-                    target_datetime_str,
-                    target_start_time,
-                    target_duration,
-                    data,
-                    tz,
-                    ind,
-                )
-        if prev_x:
-            curr_start_dt = datetime.fromisoformat(curr_start).astimezone(tz)
-            prev_start, prev_duration = parse_duration_string(prev_x["validTime"])
-            prev_start_dt = datetime.fromisoformat(prev_start).astimezone(tz)
-            if prev_start_dt < target_start_time < curr_start_dt:
-                prev_duration_int = get_duration_as_int(prev_duration)
-                offset_hours = (target_start_time - prev_start_dt).seconds / (60 * 60)
-                if prev_duration_int - offset_hours >= target_duration_int:
-                    # Target period is wholly contained inside this period
-                    return prev_x["value"]
-                else:
-                    # Target period extends beyond this period, so we need to get the
-                    # aggregate probability
-                    return get_aggregate_probability(
-                        target_datetime_str,
-                        target_start_time,
-                        target_duration,
-                        data,
-                        tz,
-                        prev_ind,
-                        prev_duration_int - offset_hours,
-                    )
-            elif target_start_time < curr_start_dt:
-                # We've passed the period we're looking for; break early.
-                break
-        prev_ind = ind
-        prev_x = x
-    log("Couldn't find any relevant probability time period")
-    return 0
+def get_probability_for_duration(index, target_start, target_duration):
+    """Find the probability of snowfall corresponding to a snowfall amount time range,
+    given as a start timestamp and a duration in seconds"""
+    ind = index.find(target_start)
+    if ind is None:
+        log("Couldn't find any relevant probability time period", "warning")
+        return 0
+    target_end = target_start + target_duration
+    if index.ends[ind] >= target_end:
+        # Target period is wholly contained inside this period
+        return index.values[ind]
+    # Target period extends beyond this period, so we need to get the aggregate
+    # probability
+    return get_aggregate_probability(index, target_start, target_duration, ind)
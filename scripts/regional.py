@@ -0,0 +1,127 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import csv
+
+from scripts.forecast import get_date_range, get_snow_data, parse_snow_data
+from scripts.utils import *
+
+
+def parse_range(range_str):
+    """Parse an inclusive "start:end" grid coordinate range."""
+    start, _, end = range_str.partition(":")
+    return range(int(start), int(end or start) + 1)
+
+
+def get_grid_locations(office, x_range, y_range, tz_name=TIMEZONE):
+    return [
+        {
+            "name": "{}-{}-{}".format(office, x, y),
+            "office": office,
+            "grid_x": x,
+            "grid_y": y,
+            "timezone": tz_name,
+        }
+        for x in x_range
+        for y in y_range
+    ]
+
+
+def parse_shard(shard, date_range, tz_name):
+    """Parse a batch of fetched gridpoints in a worker process. Returns a
+    (grid_x, grid_y, daily totals) row for each one."""
+    rows = []
+    for grid_x, grid_y, data in shard:
+        forecast = parse_snow_data(data, date_range, tz_name)
+        rows.append((grid_x, grid_y, [forecast[d] for d in date_range]))
+    return rows
+
+
+async def fetch_and_parse(locations, date_range, tz_name, workers, shard_size):
+    """Fetch every location concurrently, handing off each full shard of responses to
+    the process pool as soon as it's ready, so parsing overlaps with fetching."""
+    loop = asyncio.get_running_loop()
+    # Requests block, so they run on threads; the client's per-host limit keeps the
+    # number actually in flight polite
+    fetch_executor = ThreadPoolExecutor(max_workers=HTTP_MAX_CONNECTIONS_PER_HOST)
+    parse_executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+
+        async def fetch_location(location):
+            data = await loop.run_in_executor(
+                fetch_executor,
+                lambda: get_snow_data(location, conditional=False)[0],
+            )
+            return location, data
+
+        parsing = []
+        shard = []
+        for fetched in asyncio.as_completed([fetch_location(l) for l in locations]):
+            location, data = await fetched
+            if data is None:
+                log(
+                    "Couldn't fetch forecast for {}; skipping it.".format(
+                        location["name"]
+                    ),
+                    "warning",
+                )
+                continue
+            shard.append((location["grid_x"], location["grid_y"], data))
+            if len(shard) >= shard_size:
+                parsing.append(
+                    loop.run_in_executor(
+                        parse_executor, parse_shard, shard, date_range, tz_name
+                    )
+                )
+                shard = []
+        if shard:
+            parsing.append(
+                loop.run_in_executor(
+                    parse_executor, parse_shard, shard, date_range, tz_name
+                )
+            )
+        return [row for rows in await asyncio.gather(*parsing) for row in rows]
+    finally:
+        fetch_executor.shutdown()
+        parse_executor.shutdown()
+
+
+def get_regional_forecast(
+    office, x_range, y_range, tz_name=TIMEZONE, workers=None, shard_size=50
+):
+    """Forecast every gridpoint in the given ranges. Returns the date range and one
+    (grid_x, grid_y, daily totals) row per gridpoint, sorted by grid position."""
+    date_range = get_date_range()
+    locations = get_grid_locations(office, x_range, y_range, tz_name)
+    rows = asyncio.run(
+        fetch_and_parse(locations, date_range, tz_name, workers, shard_size)
+    )
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return date_range, rows
+
+
+def write_regional_forecast(date_range, rows, f):
+    """Write the per-day snowfall table (in mm) as CSV."""
+    writer = csv.writer(f)
+    writer.writerow(["grid_x", "grid_y"] + [d.isoformat() for d in date_range])
+    for grid_x, grid_y, totals in rows:
+        writer.writerow([grid_x, grid_y] + [round(total, 2) for total in totals])
@@ -0,0 +1,204 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+import gzip
+import hashlib
+import tarfile
+import zipfile
+from pytz import timezone
+
+from scripts.forecast import (
+    diff_forecasts,
+    get_date_range,
+    make_forecast_sentences,
+    parse_snow_data_thresholds,
+    serialize_forecast,
+)
+from scripts.french_toast import make_french_toast_sentence, parse_french_toast
+from scripts.gridpoint import extract_layers
+from scripts.tweets import compose_tweets
+from scripts.utils import *
+
+# Archived snapshots may be whole gridpoint documents or just their properties, and
+# only the series are needed either way
+SNAPSHOT_LAYERS = {"snowfallAmount": dict, "probabilityOfPrecipitation": dict}
+SNAPSHOT_KINDS = {".json": "gridpoint", ".xml": "toast"}
+SNAPSHOT_TIME_FORMATS = ["%Y%m%dT%H%M%SZ", "%Y%m%dT%H%MZ"]
+
+
+def parse_snapshot_name(name):
+    """Return (timestamp, kind) for a snapshot's file name, or None if it isn't one.
+    Names are the time the snapshot was taken, as Unix time, a UTC time like
+    20201215T120000Z, or ISO 8601, followed by .json for a gridpoint or .xml for the
+    french toast feed, and optionally .gz."""
+    base = os.path.basename(name)
+    if base.endswith(".gz"):
+        base = base[:-3]
+    stem, ext = os.path.splitext(base)
+    if ext not in SNAPSHOT_KINDS:
+        return None
+    if stem.isdigit():
+        return int(stem), SNAPSHOT_KINDS[ext]
+    for time_format in SNAPSHOT_TIME_FORMATS:
+        try:
+            taken = datetime.strptime(stem, time_format).replace(tzinfo=timezone("UTC"))
+            return taken.timestamp(), SNAPSHOT_KINDS[ext]
+        except ValueError:
+            pass
+    try:
+        taken = datetime.fromisoformat(stem)
+    except ValueError:
+        return None
+    if taken.tzinfo is None:
+        taken = taken.replace(tzinfo=timezone("UTC"))
+    return taken.timestamp(), SNAPSHOT_KINDS[ext]
+
+
+def iter_snapshots(path):
+    """Yield (timestamp, kind, contents) for every snapshot in a directory, zip file,
+    or (optionally compressed) tar archive, in the order they're stored. Archives are
+    read in a single pass, so a compressed one is never decompressed twice."""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                parsed = parse_snapshot_name(name)
+                if parsed:
+                    with open(os.path.join(root, name), "rb") as f:
+                        yield (*parsed, f.read())
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                parsed = parse_snapshot_name(info.filename)
+                if parsed and not info.is_dir():
+                    yield (*parsed, archive.read(info))
+    else:
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                parsed = parse_snapshot_name(member.name)
+                if parsed and member.isfile():
+                    yield (*parsed, archive.extractfile(member).read())
+
+
+def decompress(contents):
+    if contents[:2] == b"\x1f\x8b":
+        return gzip.decompress(contents)
+    return contents
+
+
+def parse_snapshot(contents, timestamp, tz_name, thresholds):
+    """Parse a gridpoint snapshot, in a worker process, for each probability
+    threshold. Returns a digest of the snapshot, to tell when it's unchanged from the
+    one before, the date range it was forecast for, and {threshold: forecast}."""
+    contents = decompress(contents)
+    data = extract_layers([contents], SNAPSHOT_LAYERS)
+    date_range = get_date_range(
+        datetime.fromtimestamp(timestamp, timezone(tz_name)).date()
+    )
+    forecasts = parse_snow_data_thresholds(data, date_range, tz_name, thresholds)
+    return hashlib.sha1(contents).hexdigest(), date_range, forecasts
+
+
+def load_snapshots(path, tz_name, thresholds, workers=None):
+    """Read and parse every snapshot. Gridpoints are parsed in a process pool while the
+    rest of the archive is still being read. Returns (timestamp, kind, parsed) sorted
+    by time, where parsed is the toast level for the french toast feed, and what
+    parse_snapshot returns for a gridpoint."""
+    snapshots = []
+    pending = deque()
+    workers = workers or os.cpu_count()
+    # Only hold a few snapshots per worker in memory at once
+    max_pending = 4 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def collect():
+            timestamp, future = pending.popleft()
+            try:
+                snapshots.append((timestamp, "gridpoint", future.result()))
+            except ValueError as e:
+                log(
+                    "Skipping unreadable snapshot from {}: {!r}".format(timestamp, e),
+                    "warning",
+                )
+
+        for timestamp, kind, contents in iter_snapshots(path):
+            if kind == "toast":
+                toast = decompress(contents).decode("utf-8", "replace")
+                snapshots.append((timestamp, kind, parse_french_toast(toast)))
+                continue
+            if len(pending) >= max_pending:
+                collect()
+            pending.append(
+                (
+                    timestamp,
+                    executor.submit(
+                        parse_snapshot, contents, timestamp, tz_name, thresholds
+                    ),
+                )
+            )
+        while pending:
+            collect()
+    # Each run sees the toast level as of its own time
+    snapshots.sort(key=lambda snapshot: (snapshot[0], snapshot[1] == "gridpoint"))
+    return snapshots
+
+
+def replay(snapshots, threshold, suppress_under, french_toast=True):
+    """Run loaded snapshots through the forecast and tweet pipeline in order, as if
+    the bot had run whenever one was taken. Returns (timestamp, thread) for every
+    thread it would have tweeted."""
+    threads = []
+    prev_forecast = None
+    prev_digest = None
+    toast_level = None
+    stored_level = None
+    gif_last_tweeted = None
+    # Snapshots taken at the same time were seen by the same run
+    for timestamp, group in groupby(snapshots, key=lambda snapshot: snapshot[0]):
+        sentences = []
+        for _, kind, parsed in group:
+            if kind == "toast":
+                toast_level = parsed
+                continue
+            digest, date_range, forecasts = parsed
+            # An unchanged gridpoint would have been a 304, and not diffed at all
+            if digest != prev_digest:
+                prev_digest = digest
+                current_forecast = forecasts[threshold]
+                diff = diff_forecasts(current_forecast, prev_forecast, date_range)
+                sentences = make_forecast_sentences(diff, date_range, suppress_under)
+                prev_forecast = serialize_forecast(current_forecast)
+        toast_details = None
+        if french_toast:
+            toast_details = {
+                "current_toast_level": toast_level,
+                "sentence": make_french_toast_sentence(toast_level, stored_level),
+                "gif_last_tweeted": gif_last_tweeted,
+            }
+        tweets, should_tweet_gif = compose_tweets(sentences, toast_details, timestamp)
+        if tweets:
+            threads.append((timestamp, tweets))
+        if should_tweet_gif:
+            threads.append((timestamp, [SEVERE_TOAST_GIF]))
+            gif_last_tweeted = timestamp
+        stored_level = toast_level
+    return threads
@@ -0,0 +1,60 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from config import *
+
+
+class PollScheduler:
+    """Decides how long to wait between polls in daemon mode. Polls at the minimum
+    interval while any location's grid is being updated or has snow in its forecast,
+    and backs off towards the maximum interval while things are quiet."""
+
+    def __init__(
+        self,
+        min_interval=DAEMON_MIN_INTERVAL,
+        max_interval=DAEMON_MAX_INTERVAL,
+        backoff=DAEMON_BACKOFF,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.update_times = {}
+
+    def is_active(self, results):
+        active = False
+        for name, result in results.items():
+            update_time = result["update_time"]
+            if update_time is not None:
+                if update_time != self.update_times.get(name, update_time):
+                    active = True
+                self.update_times[name] = update_time
+            if result["has_snow"]:
+                active = True
+        return active
+
+    def next_interval(self, results):
+        """Return the number of seconds to wait, given {location name: result} from
+        the poll that just finished."""
+        if self.is_active(results):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
@@ -0,0 +1,259 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from urllib.parse import unquote
+import asyncio
+import hashlib
+import json
+import signal
+
+from scripts import store
+from scripts.forecast import *
+from scripts.french_toast import fetch_french_toast
+from scripts.points import resolve_locations
+
+
+def make_resource(value):
+    """Encode a response body once, along with its ETag, so that it can be served to
+    any number of clients without doing either again."""
+    body = json.dumps(value, indent=2).encode("utf-8")
+    return body, '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+
+
+def matches_etag(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, which is what If-None-Match uses
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).astimezone().isoformat(timespec="seconds")
+
+
+class ForecastServer:
+    """Serves each location's current forecast, its latest change, and the toast
+    level over HTTP, from memory. A background refresh fetches and parses the
+    forecasts every refresh_interval seconds, so upstream requests don't depend on
+    how many clients there are. The stored forecasts, the toast level, and the HTTP
+    cache are only read, never updated, so the server can run alongside the bot. It
+    does share the bot's database, though: it creates it if there isn't one yet,
+    just as the bot would, and caches grid lookups for locations given by latitude
+    and longitude in it.
+
+    GET /forecasts lists every location, /forecasts/<name> gives one, and /toast
+    gives the toast level. Amounts are in mm."""
+
+    def __init__(self, locations=LOCATIONS, refresh_interval=SERVER_REFRESH_INTERVAL):
+        self.locations = locations
+        self.refresh_interval = refresh_interval
+        self.entries = {}
+        self.toast = None
+        self.resources = {}
+        self.next_refresh_at = 0
+
+    def refresh_location(self, location, date_range):
+        """Return the location's entry, updated from its current forecast. Entries
+        are new objects, so requests being served see either the old one or the new
+        one."""
+        data, _ = get_snow_data(location, update_cache=False, conditional=False)
+        previous = self.entries.get(location["name"])
+        if data is None:
+            log(
+                "Couldn't fetch forecast for {}; serving the last one.".format(
+                    location["name"]
+                ),
+                "warning",
+                location=location["name"],
+            )
+            return previous
+        now = time.time()
+        current_forecast = parse_snow_data(data, date_range, location["timezone"])
+        forecast = serialize_forecast(current_forecast)
+        entry = {
+            "location": location["name"],
+            "update_time": data["updateTime"],
+            "refreshed_at": format_timestamp(now),
+            "forecast": forecast,
+        }
+        if previous and previous["forecast"] == forecast:
+            entry.update(
+                (key, previous[key]) for key in ["changed_at", "diff", "sentences"]
+            )
+            return entry
+        # The first forecast is compared to the one the bot last stored
+        prev_forecast = (
+            previous["forecast"] if previous else store.get_forecast(location["name"])
+        )
+        diff = diff_forecasts(current_forecast, prev_forecast, date_range)
+        entry["changed_at"] = format_timestamp(now)
+        entry["diff"] = {d.isoformat(): change for d, change in diff.items()}
+        entry["sentences"] = make_forecast_sentences(diff, date_range)
+        return entry
+
+    def refresh_toast(self):
+        stored_toast = store.get_toast()
+        stored_level = stored_toast["level"] if stored_toast else None
+        # The bot's cache entry is left as it was (see fetch_french_toast)
+        level, _ = fetch_french_toast(stored_level)
+        return {"level": level, "refreshed_at": format_timestamp(time.time())}
+
+    def refresh(self):
+        """Fetch and parse every location's forecast and the toast level, then swap
+        in the new responses all at once."""
+        date_range = get_date_range()
+        locations = resolve_locations(self.locations)
+        with ThreadPoolExecutor(max_workers=len(locations) + 1) as executor:
+            toast = None
+            if any(location.get("french_toast") for location in locations):
+                toast = executor.submit(self.refresh_toast)
+            entries = executor.map(
+                lambda location: self.refresh_location(location, date_range),
+                locations,
+            )
+            self.entries = {
+                entry["location"]: entry for entry in entries if entry is not None
+            }
+            if toast:
+                self.toast = toast.result()
+        resources = {"/forecasts": make_resource(list(self.entries.values()))}
+        for name, entry in self.entries.items():
+            resources["/forecasts/" + name] = make_resource(entry)
+        if self.toast:
+            resources["/toast"] = make_resource(self.toast)
+        self.resources = resources
+
+    def try_refresh(self):
+        """Refresh, and keep serving the last responses if that fails."""
+        self.next_refresh_at = time.time() + self.refresh_interval
+        try:
+            self.refresh()
+        except Exception as e:
+            log("Refresh failed: {!r}".format(e), "error")
+
+    async def refresh_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max(self.next_refresh_at - time.time(), 0))
+            await loop.run_in_executor(None, self.try_refresh)
+
+    def respond(self, method, target, headers):
+        """Return the status, extra headers, and body for a request."""
+        if method not in ("GET", "HEAD"):
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"Allow": "GET, HEAD"}, b""
+        # Location names can have spaces and other characters that are escaped in
+        # URLs
+        path = unquote(target.split("?", 1)[0]).rstrip("/")
+        resource = self.resources.get(path)
+        if resource is None:
+            body, _ = make_resource({"error": "Not found"})
+            return HTTPStatus.NOT_FOUND, {}, body
+        body, etag = resource
+        response_headers = {
+            "ETag": etag,
+            # Clients can reuse a response until the next refresh
+            "Cache-Control": "max-age={}".format(
+                max(int(self.next_refresh_at - time.time()), 0)
+            ),
+        }
+        if matches_etag(headers.get("if-none-match"), etag):
+            return HTTPStatus.NOT_MODIFIED, response_headers, b""
+        return HTTPStatus.OK, response_headers, body
+
+    async def handle(self, reader, writer):
+        """Serve requests on a connection until the client closes it, asks to, or
+        goes quiet for SERVER_IDLE_TIMEOUT."""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(
+                    reader.readline(), SERVER_IDLE_TIMEOUT
+                )
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    # Keep the connection in step if a client sends a body anyway
+                    await reader.readexactly(int(headers.get("content-length", 0)))
+                except ValueError:
+                    status, response_headers, body = HTTPStatus.BAD_REQUEST, {}, b""
+                    method, version = "GET", "HTTP/1.0"
+                else:
+                    status, response_headers, body = self.respond(
+                        method, target, headers
+                    )
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                lines = [
+                    "HTTP/1.1 {} {}".format(status.value, status.phrase),
+                    "Date: " + formatdate(usegmt=True),
+                    "Content-Type: application/json",
+                    "Content-Length: {}".format(len(body)),
+                    "Connection: " + ("keep-alive" if keep_alive else "close"),
+                ]
+                lines.extend(
+                    "{}: {}".format(name, value)
+                    for name, value in response_headers.items()
+                )
+                writer.write("\r\n".join(lines).encode("latin-1") + b"\r\n\r\n")
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            ConnectionError,
+            # Raised by readline for a line too long to be a real request
+            ValueError,
+        ):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Serve until SIGINT or SIGTERM. Nothing is served until the first refresh
+        is done."""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await loop.run_in_executor(None, self.try_refresh)
+        refreshing = asyncio.create_task(self.refresh_forever())
+        server = await asyncio.start_server(self.handle, host, port)
+        log("Serving forecasts on {}:{}.".format(host, port))
+        async with server:
+            await stop.wait()
+        refreshing.cancel()
+        log("Server stopped.")
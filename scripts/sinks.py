@@ -0,0 +1,252 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import json
+import threading
+import uuid
+
+from scripts.metrics import metrics
+from scripts.posting import PostingQueue
+from scripts.utils import *
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+
+class Sink:
+    """Somewhere to send forecasts. Subclasses implement send, which sends one thread
+    of posts for a location and raises if it fails."""
+
+    def __init__(self, name, accounts=None, timeout=SINK_TIMEOUT):
+        self.name = name
+        self.accounts = accounts or {}
+        self.timeout = timeout
+
+    def send(self, location, posts):
+        raise NotImplementedError
+
+    def flush(self):
+        """Finish sending anything that send left queued."""
+        pass
+
+
+class PrintSink(Sink):
+    """Prints posts instead of sending them, for dry runs."""
+
+    lock = threading.Lock()
+
+    def send(self, location, posts):
+        # Print each thread in one go so that concurrent locations don't interleave
+        with self.lock:
+            print("\n".join(["Would tweet for {}:".format(location["name"]), *posts]))
+
+
+class TwitterSink(Sink):
+    """Queues posts to be tweeted as a thread from the location's account, or the
+    sink's own if it has one. The queue is posted when the sink is flushed."""
+
+    def __init__(
+        self,
+        name,
+        accounts=None,
+        account=None,
+        api_url=POSTING_API_URL,
+        timeout=POSTING_DEADLINE,
+    ):
+        super().__init__(name, accounts, timeout)
+        self.account = account
+        self.queue = PostingQueue(name, self.accounts, api_url)
+
+    def send(self, location, posts):
+        self.queue.enqueue(self.account or location["account"], posts)
+
+    def flush(self):
+        self.queue.drain(self.timeout)
+
+
+class MastodonSink(Sink):
+    """Posts a thread of statuses to a Mastodon instance. The account's credentials
+    need an "access_token" for an app with the write:statuses scope."""
+
+    def __init__(
+        self,
+        name,
+        accounts=None,
+        instance_url=None,
+        account=None,
+        visibility="public",
+        timeout=SINK_TIMEOUT,
+    ):
+        # Only loaded once a sink that needs it is set up
+        from scripts.client import HttpClient
+
+        super().__init__(name, accounts, timeout)
+        self.instance_url = instance_url.rstrip("/")
+        self.account = account
+        self.visibility = visibility
+        self.client = HttpClient(HEADERS, timeout=timeout)
+
+    def send(self, location, posts):
+        credentials = self.accounts[self.account or location["account"]]
+        in_reply_to = None
+        for post in posts:
+            data = {"status": post, "visibility": self.visibility}
+            if in_reply_to:
+                data["in_reply_to_id"] = in_reply_to
+            resp = self.client.request(
+                "POST",
+                self.instance_url + "/api/v1/statuses",
+                data=data,
+                headers={
+                    "Authorization": "Bearer " + credentials["access_token"],
+                    # Makes retries safe: Mastodon won't post the same key twice
+                    "Idempotency-Key": uuid.uuid4().hex,
+                },
+            )
+            in_reply_to = resp.json()["id"]
+            log('Posted to {}: "{}"'.format(self.name, post))
+
+
+class WebhookSink(Sink):
+    """POSTs each thread to a URL as JSON: {"location", "posts", "time"}."""
+
+    def __init__(
+        self, name, accounts=None, url=None, headers=None, timeout=SINK_TIMEOUT
+    ):
+        # Only loaded once a sink that needs it is set up
+        from scripts.client import HttpClient
+
+        super().__init__(name, accounts, timeout)
+        self.url = url
+        self.headers = headers or {}
+        # A webhook may not be safe to repeat, so don't retry it
+        self.client = HttpClient(HEADERS, timeout=timeout, retries=0)
+
+    def send(self, location, posts):
+        self.client.request(
+            "POST",
+            self.url,
+            json={"location": location["name"], "posts": posts, "time": time.time()},
+            headers=self.headers,
+        )
+
+
+class FileSink(Sink):
+    """Appends each thread to a file as a line of JSON: {"location", "posts",
+    "time"}. A relative path is relative to the bot's directory."""
+
+    def __init__(self, name, accounts=None, path=None, timeout=SINK_TIMEOUT):
+        super().__init__(name, accounts, timeout)
+        self.path = os.path.join(__location__, "..", path)
+        self.lock = threading.Lock()
+
+    def send(self, location, posts):
+        line = json.dumps(
+            {"location": location["name"], "posts": posts, "time": time.time()}
+        )
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+SINK_TYPES = {
+    "twitter": TwitterSink,
+    "mastodon": MastodonSink,
+    "webhook": WebhookSink,
+    "file": FileSink,
+}
+
+
+def make_sinks(sinks_config, accounts):
+    """Create a sink for each entry in SINKS, as {name: sink}."""
+    sinks = {}
+    for name, options in sinks_config.items():
+        options = dict(options)
+        sink_type = options.pop("type")
+        if sink_type not in SINK_TYPES:
+            raise ValueError("Unknown type {!r} for sink {}".format(sink_type, name))
+        sinks[name] = SINK_TYPES[sink_type](name, accounts, **options)
+    return sinks
+
+
+class Publisher:
+    """Sends each thread of posts to several sinks at once. Each sink has its own
+    timeout, and one that fails or times out is logged and doesn't affect the
+    others."""
+
+    def __init__(self, sinks, max_workers=None):
+        self.sinks = sinks
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or 4 * len(sinks),
+            thread_name_prefix="sink",
+        )
+
+    def run_all(self, action, calls):
+        """Run (sink, func, *args) calls concurrently, waiting on each until its
+        sink's timeout. Returns {sink name: whether the call succeeded}."""
+        start = time.time()
+        futures = [
+            (sink, self.executor.submit(func, *args)) for sink, func, *args in calls
+        ]
+        results = {}
+        for sink, future in futures:
+            try:
+                future.result(timeout=max(start + sink.timeout - time.time(), 0))
+            except TimeoutError:
+                # The call carries on in the background; stop waiting on it
+                log("Timed out {} {}".format(action, sink.name), "error")
+                metrics.count("sink_timeouts")
+                results[sink.name] = False
+            except Exception as e:
+                log("Failed {} {}: {!r}".format(action, sink.name, e), "error")
+                metrics.count("sink_errors")
+                results[sink.name] = False
+            else:
+                results[sink.name] = True
+        return results
+
+    def publish(self, location, threads, sink_names):
+        """Send threads of posts for a location to the named sinks. Each sink sends
+        the threads in order, independently of the others."""
+        return self.run_all(
+            "sending to",
+            [
+                (
+                    self.sinks[name],
+                    self.send_threads,
+                    self.sinks[name],
+                    location,
+                    threads,
+                )
+                for name in sink_names
+            ],
+        )
+
+    def send_threads(self, sink, location, threads):
+        for posts in threads:
+            sink.send(location, posts)
+
+    def flush(self):
+        """Flush every sink, for those that queue what they're sent."""
+        return self.run_all(
+            "flushing", [(sink, sink.flush) for sink in self.sinks.values()]
+        )
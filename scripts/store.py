@@ -0,0 +1,399 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import *
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+DATABASE_PATH = os.path.join(__location__, "..", "data/snowbot.db")
+# State files from before the database. They're imported the first time the
+# database is created.
+LEGACY_FORECAST_PATH = os.path.join(__location__, "..", "data/weather.json")
+LEGACY_TOAST_PATH = os.path.join(__location__, "..", "data/toast.json")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS forecasts (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    location TEXT NOT NULL,
+    day TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (location, run_id, day)
+);
+CREATE TABLE IF NOT EXISTS toast (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id),
+    level TEXT,
+    gif_last_tweeted REAL
+);
+CREATE INDEX IF NOT EXISTS forecasts_by_day ON forecasts (location, day, run_id);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    sink TEXT NOT NULL,
+    account TEXT NOT NULL,
+    thread_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    tweet_id TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE (thread_id, position)
+);
+CREATE TABLE IF NOT EXISTS points (
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    office TEXT NOT NULL,
+    grid_x INTEGER NOT NULL,
+    grid_y INTEGER NOT NULL,
+    timezone TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (latitude, longitude)
+);
+CREATE TABLE IF NOT EXISTS interval_sources (
+    location TEXT PRIMARY KEY,
+    timezone TEXT NOT NULL,
+    threshold REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS intervals (
+    location TEXT NOT NULL,
+    layer TEXT NOT NULL,
+    valid_time TEXT NOT NULL,
+    value REAL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    day TEXT,
+    amount REAL,
+    PRIMARY KEY (location, layer, valid_time)
+);
+"""
+
+_local = threading.local()
+# Latest forecast per location, so that a long-running process doesn't have to go back
+# to the database for the forecast it stored itself
+_latest_forecasts = {}
+
+
+def get_connection():
+    """Return this thread's connection to the database, creating the database if it
+    doesn't exist yet."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+        conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.executescript(SCHEMA)
+            upgrade_schema(conn)
+            if conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 0:
+                import_legacy_state(conn)
+        _local.conn = conn
+    return conn
+
+
+def upgrade_schema(conn):
+    """Bring the tables of a database created by an earlier version up to date."""
+    if "sink" not in [row[1] for row in conn.execute("PRAGMA table_info(outbox)")]:
+        # Before posts were queued per sink, they were all for the default one
+        conn.execute(
+            "ALTER TABLE outbox ADD COLUMN sink TEXT NOT NULL DEFAULT 'twitter'"
+        )
+    conn.executescript(
+        "DROP INDEX IF EXISTS outbox_pending;"
+        "CREATE INDEX IF NOT EXISTS outbox_pending_by_sink "
+        "ON outbox (sink, account, status, thread_id);"
+    )
+
+
+def import_legacy_state(conn):
+    """Import the JSON state files, if there are any, as the first run. The stored
+    forecast belonged to the only location there was, the first one."""
+    forecast, toast = None, None
+    if os.path.exists(LEGACY_FORECAST_PATH):
+        with open(LEGACY_FORECAST_PATH, "r") as f:
+            forecast = json.load(f)
+    if os.path.exists(LEGACY_TOAST_PATH):
+        with open(LEGACY_TOAST_PATH, "r") as f:
+            toast = json.load(f)
+    if forecast or toast:
+        insert_run(
+            conn,
+            {LOCATIONS[0]["name"]: forecast} if forecast else {},
+            (toast["level"], toast["gif_last_tweeted"]) if toast else None,
+        )
+
+
+def insert_run(conn, forecasts, toast):
+    run_id = conn.execute(
+        "INSERT INTO runs (created_at) VALUES (?)", (time.time(),)
+    ).lastrowid
+    conn.executemany(
+        "INSERT INTO forecasts (run_id, location, day, amount) VALUES (?, ?, ?, ?)",
+        [
+            (run_id, location, day, amount)
+            for location, forecast in forecasts.items()
+            for day, amount in forecast.items()
+        ],
+    )
+    if toast:
+        conn.execute(
+            "INSERT INTO toast (run_id, level, gif_last_tweeted) VALUES (?, ?, ?)",
+            (run_id, *toast),
+        )
+    return run_id
+
+
+def save_run(forecasts, toast=None):
+    """Store the forecasts from a run, as {location name: {isodate: amount}}, and the
+    (level, gif_last_tweeted) toast state if there is one, in a single transaction.
+    Returns the run's ID."""
+    conn = get_connection()
+    with conn:
+        run_id = insert_run(conn, forecasts, toast)
+    _latest_forecasts.update(forecasts)
+    return run_id
+
+
+def get_forecast(location_name, before=None):
+    """Return the most recent stored forecast for a location as {isodate: amount},
+    or None if there isn't one. If before is given, only forecasts stored at or
+    before that timestamp are considered."""
+    if before is None and location_name in _latest_forecasts:
+        return dict(_latest_forecasts[location_name])
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT MAX(runs.id) FROM forecasts JOIN runs ON runs.id = forecasts.run_id "
+        "WHERE forecasts.location = ? AND runs.created_at <= ?",
+        (location_name, before if before is not None else float("inf")),
+    ).fetchone()
+    if row[0] is None:
+        return None
+    return get_forecast_revision(location_name, row[0])
+
+
+def get_forecast_revision(location_name, run_id):
+    """Return the forecast a location had as of a given run as {isodate: amount}."""
+    rows = get_connection().execute(
+        "SELECT day, amount FROM forecasts WHERE location = ? AND run_id = ?",
+        (location_name, run_id),
+    )
+    return {day: amount for day, amount in rows}
+
+
+def get_day_history(location_name, day):
+    """Return every stored (timestamp, amount) revision of a location's forecast for
+    a given isodate, oldest first."""
+    rows = get_connection().execute(
+        "SELECT runs.created_at, forecasts.amount FROM forecasts "
+        "JOIN runs ON runs.id = forecasts.run_id "
+        "WHERE forecasts.location = ? AND forecasts.day = ? "
+        "ORDER BY forecasts.run_id",
+        (location_name, day),
+    )
+    return rows.fetchall()
+
+
+def get_toast():
+    """Return the most recent stored toast state as {"level", "gif_last_tweeted"}, or
+    None if there isn't one."""
+    row = (
+        get_connection()
+        .execute("SELECT level, gif_last_tweeted FROM toast ORDER BY run_id DESC")
+        .fetchone()
+    )
+    if row is None:
+        return None
+    return {"level": row[0], "gif_last_tweeted": row[1]}
+
+
+def get_point(latitude, longitude):
+    """Return the cached grid for a point as {"office", "grid_x", "grid_y",
+    "timezone", "fetched_at"}, or None if it isn't cached."""
+    row = (
+        get_connection()
+        .execute(
+            "SELECT office, grid_x, grid_y, timezone, fetched_at FROM points "
+            "WHERE latitude = ? AND longitude = ?",
+            (latitude, longitude),
+        )
+        .fetchone()
+    )
+    if row is None:
+        return None
+    return dict(zip(["office", "grid_x", "grid_y", "timezone", "fetched_at"], row))
+
+
+def save_point(latitude, longitude, point):
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO points "
+            "(latitude, longitude, office, grid_x, grid_y, timezone, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                latitude,
+                longitude,
+                point["office"],
+                point["grid_x"],
+                point["grid_y"],
+                point["timezone"],
+                time.time(),
+            ),
+        )
+
+
+def get_intervals(location_name):
+    """Return the timezone and probability threshold that a location's stored
+    intervals were parsed with, and the intervals as (layer, validTime, value, start,
+    end, day, amount) rows. Returns None if there aren't any."""
+    conn = get_connection()
+    source = conn.execute(
+        "SELECT timezone, threshold FROM interval_sources WHERE location = ?",
+        (location_name,),
+    ).fetchone()
+    if source is None:
+        return None
+    rows = conn.execute(
+        "SELECT layer, valid_time, value, start_time, end_time, day, amount "
+        "FROM intervals "
+        "WHERE location = ?",
+        (location_name,),
+    )
+    return source[0], source[1], rows.fetchall()
+
+
+def save_intervals(location_name, tz_name, threshold, upserts, removed, replace=False):
+    """Store the changes to a location's intervals: upserted rows in the format
+    get_intervals returns, and removed (layer, validTime) pairs. If replace is set,
+    the location's other stored intervals are dropped first."""
+    conn = get_connection()
+    with conn:
+        if replace:
+            conn.execute("DELETE FROM intervals WHERE location = ?", (location_name,))
+        conn.execute(
+            "INSERT OR REPLACE INTO interval_sources (location, timezone, threshold) "
+            "VALUES (?, ?, ?)",
+            (location_name, tz_name, threshold),
+        )
+        conn.executemany(
+            "DELETE FROM intervals WHERE location = ? AND layer = ? AND valid_time = ?",
+            [(location_name, *key) for key in removed],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO intervals "
+            "(location, layer, valid_time, value, start_time, end_time, day, amount) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(location_name, *row) for row in upserts],
+        )
+
+
+def enqueue_thread(sink, account, tweets):
+    """Queue tweets for the named sink to post from an account as a thread, each
+    replying to the one before it. Returns the thread's ID."""
+    conn = get_connection()
+    with conn:
+        # Take the write lock before reading the last thread ID, or another thread
+        # could read the same one before either of them inserts
+        conn.execute("BEGIN IMMEDIATE")
+        thread_id = conn.execute(
+            "SELECT COALESCE(MAX(thread_id), 0) + 1 FROM outbox"
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO outbox (sink, account, thread_id, position, text, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (sink, account, thread_id, position, text, time.time())
+                for position, text in enumerate(tweets)
+            ],
+        )
+    return thread_id
+
+
+def get_pending_accounts(sink):
+    rows = get_connection().execute(
+        "SELECT DISTINCT account FROM outbox WHERE sink = ? AND status = 'pending'",
+        (sink,),
+    )
+    return [row[0] for row in rows]
+
+
+def get_next_posts(sink, account):
+    """Return the next post for the named sink to send in each of an account's
+    unfinished threads, in the order the threads were queued, as (post ID, text,
+    attempts, next attempt time, ID of the tweet to reply to) rows. A post is only
+    next once the post before it in its thread has been sent."""
+    rows = get_connection().execute(
+        "SELECT post.id, post.text, post.attempts, post.next_attempt_at, "
+        "prev.tweet_id FROM outbox AS post "
+        "LEFT JOIN outbox AS prev ON prev.thread_id = post.thread_id "
+        "AND prev.position = post.position - 1 "
+        "WHERE post.sink = ? AND post.account = ? AND post.status = 'pending' "
+        "AND (post.position = 0 OR prev.status = 'sent') "
+        "ORDER BY post.thread_id",
+        (sink, account),
+    )
+    return rows.fetchall()
+
+
+def mark_post_sent(post_id, tweet_id):
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE outbox SET status = 'sent', tweet_id = ?, attempts = attempts + 1 "
+            "WHERE id = ?",
+            (tweet_id, post_id),
+        )
+
+
+def mark_post_retry(post_id, next_attempt_at, error):
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, "
+            "error = ? WHERE id = ?",
+            (next_attempt_at, error, post_id),
+        )
+
+
+def mark_post_failed(post_id, error):
+    """Give up on a post, and the rest of its thread, which can't be posted as
+    replies without it."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE outbox SET status = 'failed', attempts = attempts + 1, error = ? "
+            "WHERE id = ?",
+            (error, post_id),
+        )
+        conn.execute(
+            "UPDATE outbox SET status = 'failed', error = 'Earlier post failed' "
+            "WHERE status = 'pending' AND thread_id = "
+            "(SELECT thread_id FROM outbox WHERE id = ?)",
+            (post_id,),
+        )
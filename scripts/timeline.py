@@ -0,0 +1,140 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from datetime import time as dt_time, timedelta
+import numpy as np
+from scripts.intervals import parse_valid_time
+from scripts.metrics import metrics
+from scripts.utils import *
+
+HOUR = 60 * 60
+
+
+def parse_series(values):
+    """Return (start timestamps, durations in hours, values) arrays for a series."""
+    starts = np.empty(len(values), dtype=np.float64)
+    durations = np.empty(len(values), dtype=np.int64)
+    amounts = np.empty(len(values), dtype=np.float64)
+    for ind, x in enumerate(values):
+        starts[ind], duration = parse_valid_time(x["validTime"])
+        durations[ind] = duration // HOUR
+        amounts[ind] = x["value"] if x["value"] is not None else np.nan
+    return starts, durations, amounts
+
+
+def expand_hourly(start_hours, durations, values, length):
+    """Spread each interval's value over every hour it covers. Returns the hourly
+    values and a mask of which hours are covered by any interval."""
+    hourly = np.zeros(length, dtype=np.float64)
+    covered = np.zeros(length, dtype=bool)
+    if not len(durations):
+        return hourly, covered
+    offsets = np.arange(durations.sum()) - np.repeat(
+        np.cumsum(durations) - durations, durations
+    )
+    hours = np.repeat(start_hours, durations) + offsets
+    hourly[hours] = np.repeat(values, durations)
+    covered[hours] = True
+    return hourly, covered
+
+
+class Timeline:
+    """Snowfall and precipitation probability series aligned on one hourly grid, so
+    that per-day totals can be computed as array operations."""
+
+    def __init__(self, data, tz):
+        self.tz = tz
+        snow_starts, snow_durations, snow_values = parse_series(
+            data["snowfallAmount"]["values"]
+        )
+        pop_starts, pop_durations, pop_values = parse_series(
+            data["probabilityOfPrecipitation"]["values"]
+        )
+        all_starts = np.concatenate([snow_starts, pop_starts])
+        self.origin = (
+            np.floor(all_starts.min() / HOUR) * HOUR if len(all_starts) else 0.0
+        )
+        snow_hours = ((snow_starts - self.origin) // HOUR).astype(np.int64)
+        pop_hours = ((pop_starts - self.origin) // HOUR).astype(np.int64)
+        length = int(
+            max(
+                (snow_hours + snow_durations).max(initial=0),
+                (pop_hours + pop_durations).max(initial=0),
+            )
+        )
+
+        self.pop, self.pop_covered = expand_hourly(
+            pop_hours, pop_durations, np.nan_to_num(pop_values), length
+        )
+        self.snow_starts = snow_starts
+        self.snow_values = np.nan_to_num(snow_values)
+        with metrics.stage("probability"):
+            self.snow_probabilities = self.weighted_probabilities(
+                snow_hours, snow_durations
+            )
+
+    def weighted_probabilities(self, start_hours, durations):
+        """Duration-weighted probability of precipitation over each interval. Hours
+        without a probability are left out of the average, and intervals that start
+        in an uncovered hour get a probability of 0."""
+        covered_sum = np.concatenate([[0], np.cumsum(self.pop * self.pop_covered)])
+        covered_count = np.concatenate([[0], np.cumsum(self.pop_covered)])
+        end_hours = start_hours + durations
+        hours = covered_count[end_hours] - covered_count[start_hours]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            probabilities = (covered_sum[end_hours] - covered_sum[start_hours]) / hours
+        return np.where(self.pop_covered[start_hours] & (hours > 0), probabilities, 0)
+
+    def day_indices(self, date_range):
+        """Index into date_range of the local day each snowfall interval starts on, or
+        -1 if it falls outside the range."""
+        midnights = np.array(
+            [
+                self.tz.localize(datetime.combine(d, dt_time())).timestamp()
+                for d in date_range + [date_range[-1] + timedelta(days=1)]
+            ]
+        )
+        days = np.searchsorted(midnights, self.snow_starts, side="right") - 1
+        return np.where(days < len(date_range), days, -1)
+
+    def threshold_masks(self, thresholds):
+        """Boolean (thresholds × snowfall intervals) mask of intervals that count."""
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        return (self.snow_probabilities[np.newaxis, :] >= thresholds[:, np.newaxis]) & (
+            self.snow_values > 0
+        )
+
+    def daily_totals(self, date_range, thresholds=(PROBABILITY_THRESHOLD,)):
+        """Return a (thresholds × days) array of snowfall totals."""
+        days = self.day_indices(date_range)
+        in_range = days >= 0
+        masks = self.threshold_masks(thresholds) & in_range
+        # bincount accumulates in input order, which keeps totals identical to the
+        # per-threshold loop in scripts.forecast.parse_snow_data
+        return np.stack(
+            [
+                np.bincount(
+                    days[mask],
+                    weights=self.snow_values[mask],
+                    minlength=len(date_range),
+                )
+                for mask in masks
+            ]
+        )
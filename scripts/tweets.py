@@ -0,0 +1,163 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from functools import lru_cache
+import re
+from scripts.utils import *
+
+TWEET_LENGTH = 280
+# Starts each tweet in a thread after the first
+CONTINUED = "(cont'd.):"
+CONTINUED_LENGTH = len(CONTINUED)
+# The longest a sentence can be without being split, leaving room for CONTINUED and
+# a blank line in front of it
+PIECE_LENGTH = TWEET_LENGTH - CONTINUED_LENGTH - 2
+# Twitter counts every link as this long, whatever its actual length
+URL_LENGTH = 23
+URL_PATTERN = re.compile(r"https?://\S+")
+# Code points that count once. Everything else, emojis included, counts twice.
+SINGLE_WEIGHT_RANGES = [(0, 4351), (8192, 8205), (8208, 8223), (8242, 8247)]
+# Variation selectors, skin tones, and tags only change the look of the emoji they
+# follow, so they don't count
+MODIFIERS = re.compile("[\ufe0e\ufe0f\U0001f3fb-\U0001f3ff\U000e0020-\U000e007f]")
+ZERO_WIDTH_JOINER = "\u200d"
+KEYCAP = "\u20e3"
+
+
+def count_characters(text):
+    if text.isascii():
+        return len(text)
+    length = 0
+    joined = False
+    for char in text:
+        if joined:
+            # Joined to the emoji before it, which has already been counted
+            joined = False
+        elif char == ZERO_WIDTH_JOINER:
+            joined = True
+        elif char == KEYCAP:
+            # A keycap emoji counts twice, and its digit has been counted once
+            length += 1
+        elif not MODIFIERS.match(char):
+            code = ord(char)
+            length += (
+                1
+                if any(low <= code <= high for low, high in SINGLE_WEIGHT_RANGES)
+                else 2
+            )
+    return length
+
+
+@lru_cache(maxsize=1024)
+def get_weighted_length(text):
+    """Return the length of text as Twitter counts it against the limit: links count
+    as URL_LENGTH, and emojis and most characters outside Latin scripts count
+    twice."""
+    length = 0
+    pos = 0
+    for m in URL_PATTERN.finditer(text):
+        length += count_characters(text[pos : m.start()]) + URL_LENGTH
+        pos = m.end()
+    return length + count_characters(text[pos:])
+
+
+def split_sentence(sentence, limit):
+    """Split a sentence that's longer than limit into pieces that aren't, at spaces
+    where possible. The pieces only depend on the sentence, so a thread is split the
+    same way every time it's composed."""
+    if get_weighted_length(sentence) <= limit:
+        return [sentence]
+    pieces = []
+    words = []
+    length = 0
+    for word in sentence.split(" "):
+        weight = get_weighted_length(word)
+        if words and length + 1 + weight > limit:
+            pieces.append(" ".join(words))
+            words, length = [], 0
+        if weight > limit:
+            # Too long for a tweet even on its own, so it has to be cut up
+            for char in word:
+                char_weight = get_weighted_length(char)
+                if words and length + char_weight > limit:
+                    pieces.append("".join(words))
+                    words, length = [], 0
+                words.append(char)
+                length += char_weight
+            pieces.append("".join(words))
+            words, length = [], 0
+            continue
+        length += weight + (1 if words else 0)
+        words.append(word)
+    if words:
+        pieces.append(" ".join(words))
+    return pieces
+
+
+def make_tweets(sentences, append=None):
+    """Pack sentences into a thread of tweets, in order, each one on its own line.
+    append, if given, goes after a blank line at the end. A sentence is only split
+    across tweets if it doesn't fit in one. The sentences list is left as it was."""
+    entries = list(sentences)
+    if append:
+        # Joined on with a newline like the rest, this leaves a blank line before it
+        entries.append("\n" + append if entries else append)
+    weights = list(map(get_weighted_length, entries))
+    if weights and max(weights) > PIECE_LENGTH:
+        entries = [
+            piece for entry in entries for piece in split_sentence(entry, PIECE_LENGTH)
+        ]
+        weights = list(map(get_weighted_length, entries))
+    tweets = []
+    start = 0
+    # Less the newline that would go before the first entry
+    length = -1
+    for end, weight in enumerate(weights):
+        if end > start and length + 1 + weight > TWEET_LENGTH:
+            tweets.append("\n".join(entries[start:end]))
+            start = end
+            length = CONTINUED_LENGTH
+        length += 1 + weight
+    if start < len(entries):
+        tweets.append("\n".join(entries[start:]))
+    for i in range(1, len(tweets)):
+        tweets[i] = CONTINUED + "\n" + tweets[i]
+    return tweets
+
+
+@lru_cache(maxsize=256)
+def make_thread(sentences, append=None):
+    """make_tweets for a tuple of sentences, cached, so that a diff that's come up
+    before (for another location, or on an earlier poll or replayed run) isn't
+    packed again."""
+    return tuple(make_tweets(sentences, append))
+
+
+def compose_tweets(sentences, toast_details=None, now=None):
+    """Return the thread of tweets for a location's forecast sentences, and whether
+    the toast gif should be tweeted too. If toast_details is given, the french toast
+    sentence is appended to the thread."""
+    if not toast_details:
+        return list(make_thread(tuple(sentences))), False
+    tweets = list(make_thread(tuple(sentences), toast_details["sentence"]))
+    should_tweet_gif = get_should_tweet_gif(
+        toast_details["current_toast_level"], toast_details["gif_last_tweeted"], now
+    )
+    return tweets, should_tweet_gif
@@ -20,45 +20,172 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from concurrent.futures import TimeoutError
 from datetime import datetime
 import os
-import requests
+import threading
 import time
 from config import *
+from urllib.parse import urlsplit
+from scripts import http_cache
+from scripts.logger import logger
+from scripts.metrics import metrics
+from scripts.gridpoint import CHUNK_SIZE, extract_layers
 
-__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 HEADERS = {"user-agent": "{name} {url}".format(name=APP_NAME, url=REPO_URL)}
+# Returned by fetch when a conditional request finds the resource unchanged
+NOT_MODIFIED = object()
+_client = None
 
 
-def log(message):
-    """Write message to a logfile."""
-    with open(os.path.join(__location__, "..", "snowbot.log"), "a") as f:
-        f.write("\n" + datetime.today().strftime("%H:%M %Y-%m-%d") + " " + message)
+def log(message, level="info", **fields):
+    """Write message to the log, along with any fields. See logger.Logger."""
+    logger.log(message, level, **fields)
 
 
-def fetch(url, is_json=False):
-    """Make a request to a URL, and handle errors as needed."""
+def get_client():
+    """Return the HTTP client shared by all requests in this process."""
+    # requests is slow to import, so it's only loaded once there's a request to make
+    from scripts.client import HttpClient
+
+    global _client
+    if _client is None:
+        _client = HttpClient(HEADERS)
+    return _client
+
+
+def get(url, conditional=False, update_cache=True, stream=False, deadline=None):
+    """Make a GET request, and handle errors as needed. Returns the response,
+    NOT_MODIFIED (see fetch), or None if the request fails or runs past the deadline
+    (see HttpClient.request). Callers should only store a successful conditional
+    response in the cache once they've read it."""
+    headers = {}
+    entry = None
+    if conditional:
+        entry = http_cache.load_entry(url)
+        if entry:
+            if http_cache.is_fresh(entry):
+                return NOT_MODIFIED
+            headers = http_cache.get_conditional_headers(entry)
+    return send_get(url, headers, entry, update_cache, stream, deadline)
+
+
+def send_get(url, headers, entry, update_cache, stream, deadline):
+    """Make the request for get, once it's clear there's one to make. headers are
+    the conditional headers from the cache entry, if there is one."""
+    import requests
+    from scripts.client import CircuitOpenError
+
     try:
-        resp = requests.get(url, headers=HEADERS, timeout=5)
+        resp = get_client().get(url, headers=headers, stream=stream, deadline=deadline)
+    except CircuitOpenError:
+        log("Skipping {} after repeated failures".format(url), "warning")
     except requests.exceptions.Timeout:
-        log("Request timed out when trying to hit {}".format(url))
+        log("Request timed out when trying to hit {}".format(url), "warning")
     except requests.exceptions.ConnectionError:
-        log("Connection error when trying to hit {}".format(url))
-    except requests.exceptions.HTTPError:
-        log("HTTP error when trying to hit {}".format(url))
+        log("Connection error when trying to hit {}".format(url), "warning")
+    except requests.exceptions.HTTPError as e:
+        log(
+            "HTTP error {} when trying to hit {}".format(e.response.status_code, url),
+            "warning",
+        )
     else:
-        if is_json:
-            return resp.json()
+        if headers and resp.status_code == 304:
+            resp.close()
+            if update_cache:
+                http_cache.store_entry(url, resp.headers, entry)
+            return NOT_MODIFIED
+        return resp
+
+
+def fetch(url, is_json=False):
+    """Make a request to a URL, and handle errors as needed. Returns None if the
+    request fails, or if is_json is set and the response isn't JSON."""
+    resp = get(url)
+    if resp is None:
+        return None
+    if not is_json:
         return resp.text
+    try:
+        return resp.json()
+    except ValueError:
+        log("Response from {} isn't JSON".format(url), "warning")
+        return None
+
+
+def fetch_layers(url, layers, conditional=False, update_cache=True):
+    """Stream a JSON document, and return only the values of the given keys, as
+    {key: value}; see gridpoint.extract_layers. If conditional is set, the values are
+    NOT_MODIFIED when the document hasn't changed since its validators were last
+    stored, and None if the request fails.
+
+    Also returns a function that stores the response's validators in the HTTP cache
+    (or None if there's nothing to store). Call it only once the values have been
+    handled and the result stored, or a run that fails after the fetch would leave
+    the next one with a 304 for a change it never handled."""
+    resp = get(url, conditional, update_cache, stream=True)
+    if resp is None or resp is NOT_MODIFIED:
+        return resp, None
+    values = read_layers(url, resp, layers)
+    if values is None or not (conditional and update_cache):
+        return values, None
+    return values, lambda: http_cache.store_entry(url, resp.headers)
+
+
+def read_layers(url, resp, layers):
+    """Read the given layers from a streamed response, then the rest of it, and
+    close it. Returns None if the response can't be read."""
+    import requests
+
+    num_bytes = 0
+
+    def count(chunks):
+        nonlocal num_bytes
+        for chunk in chunks:
+            num_bytes += len(chunk)
+            yield chunk
+
+    chunks = count(resp.iter_content(chunk_size=CHUNK_SIZE))
+    try:
+        values = extract_layers(chunks, layers)
+        # Closing before the body has been read in full drops the connection, so
+        # read the rest a chunk at a time and let the connection go back to the pool
+        for _ in chunks:
+            pass
+        return values
+    except (ValueError, requests.exceptions.RequestException) as e:
+        log("Couldn't read response from {}: {!r}".format(url, e), "warning")
+        return None
+    finally:
+        resp.close()
+        metrics.record_bytes(urlsplit(url).netloc, num_bytes)
 
 
-def parse_duration_string(validTime):
-    """Return [datestring, duration] for a given validTime"""
-    return validTime.split("/PT")
+class DeadlineResult:
+    """The result of a future, for as long as it arrives by a deadline. Once a get
+    has given up on it, every later get gives up too, even if it has arrived since,
+    so that everything that asks sees the same answer."""
 
+    def __init__(self, future, deadline, name):
+        self.future = future
+        self.deadline = deadline
+        self.name = name
+        self.gave_up = False
+        self.lock = threading.Lock()
 
-def get_duration_as_int(duration):
-    return int(duration.strip("H"))
+    def get(self):
+        """Return the result, or None if it failed or didn't arrive in time."""
+        with self.lock:
+            if self.gave_up:
+                return None
+            try:
+                return self.future.result(timeout=max(self.deadline - time.time(), 0))
+            except TimeoutError:
+                log("Gave up waiting on {}.".format(self.name), "warning")
+            except Exception as e:
+                log("Failed to get {}: {!r}".format(self.name, e), "warning")
+            self.gave_up = True
+            return None
 
 
 def get_accumulation_string(accum):
@@ -70,7 +197,8 @@ def get_accumulation_string(accum):
     return round(inches, 1)
 
 
-def get_should_tweet_gif(severity, time_last_tweeted):
+def get_should_tweet_gif(severity, time_last_tweeted, now=None):
+    now = now or time.time()
     return severity == "severe" and (
-        not time_last_tweeted or time.time() - time_last_tweeted > TOAST_GIF_DELAY
+        not time_last_tweeted or now - time_last_tweeted > TOAST_GIF_DELAY
     )
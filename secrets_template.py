@@ -2,3 +2,14 @@ CONSUMER_API_KEY = ""
 CONSUMER_API_SECRET = ""
 ACCESS_TOKEN = ""
 ACCESS_KEY = ""
+
+# Credentials for each account named in config.LOCATIONS and config.SINKS. Mastodon
+# accounts only need an "access_token".
+ACCOUNTS = {
+    "default": {
+        "consumer_api_key": CONSUMER_API_KEY,
+        "consumer_api_secret": CONSUMER_API_SECRET,
+        "access_token": ACCESS_TOKEN,
+        "access_key": ACCESS_KEY,
+    },
+}
@@ -19,49 +19,77 @@
 # SOFTWARE.
 
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 import argparse
-import tweepy
+import importlib.util
+import signal
+import sys
+import threading
 
-from secrets import *
+from scripts import store
 from scripts.forecast import *
+from scripts.logger import logger
 from scripts.french_toast import get_french_toast
+from scripts.metrics import Profiler, metrics
+from scripts.points import resolve_locations
+from scripts.scheduler import PollScheduler
+from scripts.sinks import Publisher, PrintSink, make_sinks
+from scripts.tweets import compose_tweets
 from scripts.utils import *
 
 FORECAST_API_URL = "https://api.weather.gov/gridpoints/{office}/{grid_x},{grid_y}"
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+SECRETS_PATH = os.path.join(__location__, "secrets.py")
+_publisher = None
 
 
-def make_tweets(sentences, append=None):
-    tweet = ""
-    tweets = []
-    if append:
-        sentences.append(append)
-    while sentences:
-        if len(tweet) + len(sentences[0]) > 278:
-            # Append what we have and start a new tweet.
-            tweets.append(tweet)
-            tweet = "(cont'd.):"
+@lru_cache(maxsize=None)
+def get_accounts():
+    """Load the posting credentials from secrets.py. It's loaded by path under its
+    own module name, rather than imported as secrets, so that it doesn't take the
+    place of the standard library's secrets module, and so that runs that don't post
+    don't have to load it at all."""
+    spec = importlib.util.spec_from_file_location("snowbot_secrets", SECRETS_PATH)
+    secrets = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(secrets)
+    if hasattr(secrets, "ACCOUNTS"):
+        return secrets.ACCOUNTS
+    # secrets.py predates multiple accounts, so use its single set of credentials
+    return {
+        "default": {
+            "consumer_api_key": secrets.CONSUMER_API_KEY,
+            "consumer_api_secret": secrets.CONSUMER_API_SECRET,
+            "access_token": secrets.ACCESS_TOKEN,
+            "access_key": secrets.ACCESS_KEY,
+        }
+    }
+
+
+def get_publisher(dry_run):
+    """Return the publisher, which keeps its sinks' clients for as long as the process
+    runs. Dry runs print everything instead."""
+    global _publisher
+    if _publisher is None:
+        if dry_run:
+            sinks = {"print": PrintSink("print")}
         else:
-            if len(tweet) != 0:
-                tweet += "\n"
-                if len(sentences) == 1 and append:
-                    tweet += "\n"
-            tweet += sentences.pop(0)
-    if len(tweet):
-        tweets.append(tweet)
-    return tweets
-
-
-def send_tweets(tweets):
-    auth = tweepy.OAuthHandler(CONSUMER_API_KEY, CONSUMER_API_SECRET)
-    auth.set_access_token(ACCESS_TOKEN, ACCESS_KEY)
-    api = tweepy.API(auth)
-    for tweet in tweets:
-        try:
-            api.update_status(tweet)
-            log('Tweeted: "' + tweet)
-        except tweepy.TweepError as e:
-            log("Failed to tweet: " + e.reason)
+            sinks = make_sinks(SINKS, get_accounts())
+            for location in LOCATIONS:
+                for name in location["sinks"]:
+                    if name not in sinks:
+                        raise ValueError(
+                            "Unknown sink {} for {}".format(name, location["name"])
+                        )
+        _publisher = Publisher(sinks, max_workers=len(LOCATIONS) * len(sinks))
+    return _publisher
+
+
+def send_tweets(threads, location, dry_run=False):
+    """Send threads of tweets for a location to each of its sinks at once."""
+    get_publisher(dry_run).publish(
+        location, threads, ["print"] if dry_run else location["sinks"]
+    )
 
 
 def parse_args():
@@ -71,57 +99,329 @@ def parse_args():
         help="dry run without sending any tweets or storing the new forecast",
         action="store_true",
     )
+    parser.add_argument(
+        "--daemon",
+        help="keep running, polling for forecast changes on an adaptive schedule",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compare-to",
+        metavar="DATETIME",
+        type=lambda value: datetime.fromisoformat(value).timestamp(),
+        help="diff against the forecast as it was stored at this ISO 8601 time, "
+        "rather than the most recent one",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        default=METRICS_PATH,
+        help="after each run, write per-stage timings, HTTP stats, and counts to this "
+        "file: a Prometheus textfile if it ends in .prom, and JSON otherwise",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="write cProfile stats for the run (or all polls so far, with --daemon) "
+        "to this file",
+    )
+    parser.add_argument(
+        "--region",
+        metavar="OFFICE",
+        help="instead of tweeting, forecast every gridpoint in a forecast office's "
+        "grid area (given by --grid-x and --grid-y) and print a per-day snowfall table",
+    )
+    parser.add_argument(
+        "--grid-x", metavar="START:END", help="inclusive range of grid x coordinates"
+    )
+    parser.add_argument(
+        "--grid-y", metavar="START:END", help="inclusive range of grid y coordinates"
+    )
+    parser.add_argument(
+        "--workers", type=int, help="number of processes to parse forecasts with"
+    )
+    parser.add_argument("--output", help="file to write the regional forecast table to")
+    parser.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="instead of tweeting, serve each location's forecast, its latest change, "
+        "and the toast level as JSON over HTTP, refreshed in the background",
+    )
     args = parser.parse_args()
+    if args.region and not (args.grid_x and args.grid_y):
+        parser.error("--region requires --grid-x and --grid-y")
     return args
 
 
-def run():
-    args = parse_args()
-
-    # Gather forecast, etc. data
-    snow_data = get_snow_data()
-    date_range = get_date_range()
-    current_forecast = parse_snow_data(snow_data, date_range)
-    prev_forecast = get_stored_snow_data()
-    diff = diff_forecasts(current_forecast, prev_forecast, date_range)
-    if ENABLE_FRENCH_TOAST:
-        toast_details = get_french_toast(args.dry_run)
-
-    # Form tweets
-    sentences = make_forecast_sentences(diff, date_range)
-    if ENABLE_FRENCH_TOAST:
-        tweets = make_tweets(sentences, toast_details["sentence"])
+def run_location(
+    location,
+    date_range,
+    toast,
+    dry_run,
+    compare_to=None,
+    fetches=None,
+    stored_forecast=None,
+):
+    """Fetch, diff, and tweet the forecast for one location. toast is a
+    DeadlineResult for the french toast details, if there are any, and
+    stored_forecast may be a future for the stored forecast to diff against. Returns
+    the forecast to store for next time (or None if there's nothing new to store),
+    the grid's update time, and whether there's snow in the forecast."""
+    with metrics.stage("fetch"):
+        if fetches:
+            snow_data = fetches.get(location)
+        else:
+            # There's no GridpointFetches to store the validators once the forecast
+            # is stored, so the next run fetches it in full
+            snow_data, _ = get_snow_data(location, update_cache=not dry_run)
+    if stored_forecast:
+        prev_forecast = stored_forecast.result()
     else:
-        tweets = make_tweets(sentences)
+        prev_forecast = get_stored_snow_data(location, compare_to)
+    if snow_data is NOT_MODIFIED and prev_forecast is None:
+        # Validators are stored per grid cell, but forecasts per location, so a
+        # location added to a cell that has already been fetched would never see its
+        # forecast until the grid next changes
+        log(
+            "No stored forecast for {}; fetching its grid in full.".format(
+                location["name"]
+            ),
+            location=location["name"],
+        )
+        with metrics.stage("fetch"):
+            snow_data, _ = get_snow_data(
+                location, update_cache=False, conditional=False
+            )
+    if snow_data is None or snow_data is NOT_MODIFIED:
+        # Nothing to parse or diff: either the forecast couldn't be fetched, or it
+        # was already handled on a previous run
+        if snow_data is None:
+            log(
+                "Couldn't fetch forecast for {}; skipping it.".format(location["name"]),
+                "warning",
+                location=location["name"],
+            )
+        current_forecast = None
+        sentences = []
+        has_snow = bool(prev_forecast) and any(
+            amount > 0 for amount in prev_forecast.values()
+        )
+    else:
+        with metrics.stage("parse"):
+            if dry_run:
+                # Leave the stored intervals for the next real run to update
+                current_forecast = parse_snow_data(
+                    snow_data, date_range, location["timezone"]
+                )
+            else:
+                current_forecast = parse_snow_data_incremental(
+                    location, snow_data, date_range
+                )
+        with metrics.stage("diff"):
+            diff = diff_forecasts(current_forecast, prev_forecast, date_range)
+        with metrics.stage("compose"):
+            sentences = make_forecast_sentences(diff, date_range)
+        has_snow = any(amount > 0 for amount in current_forecast.values())
+
+    # Form tweets. The toast is only waited on now, and only until its deadline, so
+    # a slow feed can't hold up the forecast.
+    toast_details = None
+    if toast and location.get("french_toast"):
+        with metrics.stage("toast_wait"):
+            toast_details = toast.get()
+    with metrics.stage("compose"):
+        tweets, should_tweet_gif = compose_tweets(sentences, toast_details)
 
     # Send tweets
-    if not args.dry_run:
-        if len(tweets):
-            send_tweets(tweets)
-        else:
-            log("No changed forecast to tweet.")
-        if ENABLE_FRENCH_TOAST:
-            should_tweet_gif = get_should_tweet_gif(
-                toast_details["current_toast_level"], toast_details["gif_last_tweeted"]
-            )
-            if should_tweet_gif:
-                log("Tweeting toast gif.")
-                send_tweets([SEVERE_TOAST_GIF])
+    threads = []
+    if len(tweets):
+        threads.append(tweets)
+    elif dry_run:
+        print("No changed forecast to tweet for {}.".format(location["name"]))
+    else:
+        log(
+            "No changed forecast to tweet for {}.".format(location["name"]),
+            location=location["name"],
+        )
+    if should_tweet_gif:
+        if not dry_run:
+            log("Tweeting toast gif.", location=location["name"])
+        threads.append([SEVERE_TOAST_GIF])
+    if threads:
+        with metrics.stage("post"):
+            send_tweets(threads, location, dry_run)
+    return {
+        "forecast": current_forecast,
+        "update_time": (
+            snow_data["updateTime"] if current_forecast is not None else None
+        ),
+        "has_snow": has_snow,
+    }
+
+
+def fetch_toast(deadline):
+    with metrics.stage("toast"):
+        return get_french_toast(deadline)
+
+
+def run_region(args):
+    from scripts.regional import (
+        get_regional_forecast,
+        parse_range,
+        write_regional_forecast,
+    )
 
-        # Store forecast for next time
-        store_forecast(current_forecast)
+    logger.start_run()
+    date_range, rows = get_regional_forecast(
+        args.region,
+        parse_range(args.grid_x),
+        parse_range(args.grid_y),
+        workers=args.workers,
+    )
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            write_regional_forecast(date_range, rows, f)
     else:
-        if len(tweets):
-            print("Would tweet:")
-            [print(tweet) for tweet in tweets]
-        else:
-            print("No changed forecast to tweet.")
-        if ENABLE_FRENCH_TOAST:
-            should_tweet_gif = get_should_tweet_gif(
-                toast_details["current_toast_level"], toast_details["gif_last_tweeted"]
+        write_regional_forecast(date_range, rows, sys.stdout)
+
+
+def run_server(args):
+    import asyncio
+    from scripts.server import ForecastServer
+
+    host, _, port = args.serve.rpartition(":")
+    logger.start_run()
+    asyncio.run(ForecastServer().serve(host or "127.0.0.1", int(port)))
+
+
+def run_once(args, executor, profiler=None):
+    """Fetch, diff, and tweet every location's forecast, then store them. Returns
+    {location name: result} for each location that ran successfully."""
+    metrics.reset()
+    logger.start_run()
+    date_range = get_date_range()
+    call = profiler.runcall if profiler else lambda func, *args: func(*args)
+
+    # Start every fetch and stored state read at once. The toast feed is
+    # independent of the forecasts, so it's fetched alongside them.
+    toast = None
+    if any(location.get("french_toast") for location in LOCATIONS):
+        deadline = time.time() + TOAST_DEADLINE
+        toast = DeadlineResult(
+            executor.submit(call, fetch_toast, deadline),
+            deadline,
+            "french toast level",
+        )
+    with metrics.stage("resolve"):
+        locations = resolve_locations(LOCATIONS)
+    stored_forecasts = {
+        location["name"]: executor.submit(
+            get_stored_snow_data, location, args.compare_to
+        )
+        for location in locations
+    }
+
+    # Each location is fetched, diffed, and tweeted independently, so a run takes
+    # about as long as the slowest location rather than all of them added up.
+    # Locations in the same grid cell share its fetch.
+    fetches = GridpointFetches(update_cache=not args.dry_run)
+    futures = {
+        executor.submit(
+            call,
+            run_location,
+            location,
+            date_range,
+            toast,
+            args.dry_run,
+            args.compare_to,
+            fetches,
+            stored_forecasts[location["name"]],
+        ): location
+        for location in locations
+    }
+    results = {}
+    for future in as_completed(futures):
+        location = futures[future]
+        try:
+            results[location["name"]] = future.result()
+        except Exception as e:
+            log(
+                "Failed to run forecast for {}: {!r}".format(location["name"], e),
+                "error",
+                location=location["name"],
             )
-            if should_tweet_gif:
-                print(SEVERE_TOAST_GIF)
+
+    # Store forecasts and toast level for next time
+    forecasts = {
+        name: serialize_forecast(result["forecast"])
+        for name, result in results.items()
+        if result["forecast"] is not None
+    }
+    toast_details = toast.get() if toast else None
+    if not args.dry_run and (forecasts or toast_details):
+        with metrics.stage("store"):
+            store.save_run(forecasts, toast_details["state"] if toast_details else None)
+        fetches.store_validators(set(forecasts))
+        if toast_details and toast_details["update_cache"]:
+            toast_details["update_cache"]()
+    if not args.dry_run:
+        with metrics.stage("post"):
+            get_publisher(args.dry_run).flush()
+    if args.metrics:
+        metrics.write(args.metrics)
+    return results
+
+
+def run_daemon(args, executor, profiler=None):
+    """Poll until interrupted, keeping the HTTP client, database connections, and
+    posting clients alive between polls."""
+    stop = threading.Event()
+
+    def shut_down(signum, frame):
+        log("Received signal {}; shutting down after this poll.".format(signum))
+        stop.set()
+
+    signal.signal(signal.SIGINT, shut_down)
+    signal.signal(signal.SIGTERM, shut_down)
+    scheduler = PollScheduler()
+    log("Starting daemon.")
+    while not stop.is_set():
+        try:
+            if profiler:
+                results = profiler.runcall(run_once, args, executor, profiler)
+                profiler.dump(args.profile)
+            else:
+                results = run_once(args, executor)
+        except Exception as e:
+            log("Poll failed: {!r}".format(e), "error")
+            results = {}
+        interval = scheduler.next_interval(results)
+        stop.wait(interval)
+    log("Daemon stopped.")
+
+
+def run():
+    args = parse_args()
+    if args.region:
+        run_region(args)
+        return
+    if args.serve:
+        run_server(args)
+        return
+
+    profiler = Profiler() if args.profile else None
+    # Each location needs a thread for itself and one for its stored forecast, and
+    # the toast feed needs one, so that none of them have to wait for a thread
+    with ThreadPoolExecutor(max_workers=2 * len(LOCATIONS) + 1) as executor:
+        try:
+            if args.daemon:
+                run_daemon(args, executor, profiler)
+            elif profiler:
+                profiler.runcall(run_once, args, executor, profiler)
+            else:
+                run_once(args, executor)
+        finally:
+            if profiler:
+                profiler.dump(args.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import threading
+
+import pytest
+
+# The modules import each other from the top of the repository, as snowbot.py does
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmarks.fakes import FakeServer
+from scripts import store
+from scripts.logger import logger
+
+
+@pytest.fixture
+def database(monkeypatch, tmp_path):
+    """Point the store at a scratch database, with no connections open to it yet,
+    and the log at a scratch file."""
+    monkeypatch.setattr(store, "DATABASE_PATH", str(tmp_path / "snowbot.db"))
+    monkeypatch.setattr(store, "LEGACY_FORECAST_PATH", str(tmp_path / "weather.json"))
+    monkeypatch.setattr(store, "LEGACY_TOAST_PATH", str(tmp_path / "toast.json"))
+    monkeypatch.setattr(store, "_local", threading.local())
+    monkeypatch.setattr(store, "_latest_forecasts", {})
+    monkeypatch.setattr(logger, "path", str(tmp_path / "snowbot.log"))
+    yield tmp_path
+    # Records are written in the background, so write them before the path is put back
+    logger.flush()
+
+
+class ScriptedServer(FakeServer):
+    """Gives each request the next (status, headers, body) in responses, and the
+    last one once they run out. The headers of each request are kept in received."""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.script = list(responses)
+        self.received = []
+
+    @property
+    def requests(self):
+        return len(self.received)
+
+    def respond(self, method, path, headers, body):
+        with self.lock:
+            self.received.append(headers)
+            return self.script.pop(0) if len(self.script) > 1 else self.script[0]
+
+
+@pytest.fixture
+def start_server():
+    """Start one of the benchmarks' fake servers with start_server(server). Servers
+    are shut down after the test."""
+    servers = []
+
+    def start_server(server):
+        # Poll often, so that shutting the server down doesn't hold up the tests
+        threading.Thread(
+            target=server.httpd.serve_forever, args=(0.01,), daemon=True
+        ).start()
+        servers.append(server)
+        return server
+
+    yield start_server
+    for server in servers:
+        server.httpd.shutdown()
+        server.httpd.server_close()
+
+
+@pytest.fixture
+def serve(start_server):
+    """Start a ScriptedServer with serve(*responses); see start_server."""
+    return lambda *responses: start_server(ScriptedServer(responses))
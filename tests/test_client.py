@@ -0,0 +1,170 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from urllib.parse import urlsplit
+import time
+
+import pytest
+import requests
+
+from scripts import client as client_module
+from scripts.client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+class Clock:
+    """Stands in for the time module in scripts.client. Sleeps are recorded instead
+    of waited out, and monotonic time only moves when a test moves it."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+    def monotonic(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(client_module, "time", clock)
+    return clock
+
+
+def test_retries_with_backoff(serve, clock):
+    server = serve((503, {}, b""), (502, {}, b""), (200, {}, b"ok"))
+    client = HttpClient(retries=3, backoff=1, max_backoff=30)
+    assert client.get(server.url).text == "ok"
+    assert server.requests == 3
+    assert len(clock.sleeps) == 2
+    # Full jitter: anywhere up to the doubled backoff for each attempt
+    for attempt, delay in enumerate(clock.sleeps):
+        assert 0 <= delay <= 2**attempt
+
+
+def test_honors_retry_after(serve, clock):
+    server = serve((429, {"Retry-After": "7"}, b""), (200, {}, b"ok"))
+    client = HttpClient(retries=1, max_backoff=30)
+    assert client.get(server.url).text == "ok"
+    assert clock.sleeps == [7]
+
+
+def test_retry_after_is_capped(serve, clock):
+    server = serve((503, {"Retry-After": "3600"}, b""), (200, {}, b"ok"))
+    HttpClient(retries=1, max_backoff=30).get(server.url)
+    assert clock.sleeps == [30]
+
+
+def test_gives_up_after_retries(serve, clock):
+    server = serve((503, {}, b""))
+    with pytest.raises(requests.exceptions.HTTPError) as excinfo:
+        HttpClient(retries=2).get(server.url)
+    assert excinfo.value.response.status_code == 503
+    assert server.requests == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_client_errors_arent_retried(serve, clock):
+    server = serve((404, {}, b""))
+    with pytest.raises(requests.exceptions.HTTPError):
+        HttpClient(retries=2).get(server.url)
+    assert server.requests == 1
+    assert clock.sleeps == []
+
+
+def test_deadline_cuts_retries_short(serve, clock):
+    server = serve((503, {"Retry-After": "10"}, b""))
+    with pytest.raises(requests.exceptions.HTTPError):
+        HttpClient(retries=3).get(server.url, deadline=time.time() + 5)
+    assert server.requests == 1
+    assert clock.sleeps == []
+
+
+def test_connection_errors_are_retried(serve, clock):
+    server = serve((200, {}, b""))
+    url = server.url
+    server.httpd.shutdown()
+    server.httpd.server_close()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        HttpClient(retries=2).get(url)
+    assert len(clock.sleeps) == 2
+
+
+def test_circuit_breaker(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    clock.now += 59
+    assert not breaker.allow()
+    # Half-open: one trial request, and a single failure opens it again
+    clock.now += 1
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_circuit_opens_on_failing_host(serve, clock, monkeypatch):
+    monkeypatch.setattr(client_module, "CIRCUIT_BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr(client_module, "CIRCUIT_BREAKER_COOLDOWN", 60)
+    server = serve((503, {}, b""), (503, {}, b""), (200, {}, b"ok"))
+    client = HttpClient(retries=0)
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.get(server.url)
+    with pytest.raises(CircuitOpenError):
+        client.get(server.url)
+    assert server.requests == 2
+
+    clock.now += 60
+    assert client.get(server.url).text == "ok"
+    assert server.requests == 3
+
+
+def test_streamed_response_holds_host_slot(serve):
+    """A streamed body is still being downloaded after the request returns, so the
+    host's connection slot is only given back when the response is closed."""
+    server = serve((200, {}, b"x" * 1000))
+    client = HttpClient(max_per_host=1)
+    slot = client.get_host_limit(urlsplit(server.url).netloc)
+
+    resp = client.get(server.url, stream=True)
+    assert not slot.acquire(blocking=False)
+    resp.close()
+    assert slot.acquire(blocking=False)
+    slot.release()
+    # Closing twice mustn't give the slot back twice
+    resp.close()
+
+    client.get(server.url)
+    assert slot.acquire(blocking=False)
@@ -0,0 +1,198 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from datetime import date, datetime, timezone
+import json
+
+import pytest
+
+from benchmarks.synthetic import make_document, make_gridpoint
+from config import TIMEZONE
+from scripts import forecast, http_cache, utils
+from scripts.forecast import (
+    TIMELINE_MIN_THRESHOLDS,
+    GridpointFetches,
+    get_date_range,
+    parse_snow_data,
+    parse_snow_data_thresholds,
+)
+from scripts.gridpoint import GRIDPOINT_LAYERS
+from scripts.incremental import IncrementalForecast
+
+START = datetime(2020, 12, 14, 5, tzinfo=timezone.utc)
+DATE_RANGE = get_date_range(date(2020, 12, 14))
+# Enough for parse_snow_data_thresholds to use the Timeline
+THRESHOLDS = list(range(0, 100, 100 // TIMELINE_MIN_THRESHOLDS))
+
+
+def make_data(snow, probabilities):
+    """Gridpoint properties from lists of (validTime, value)."""
+    return {
+        "snowfallAmount": {
+            "values": [{"validTime": vt, "value": value} for vt, value in snow]
+        },
+        "probabilityOfPrecipitation": {
+            "values": [{"validTime": vt, "value": value} for vt, value in probabilities]
+        },
+    }
+
+
+# Hand-made forecasts for the shapes the synthetic ones don't cover
+CASES = {
+    "multi-hour": make_data(
+        [
+            ("2020-12-14T05:00:00+00:00/PT6H", 12.7),
+            ("2020-12-14T11:00:00+00:00/PT3H", 2.5),
+            ("2020-12-15T02:00:00+00:00/PT12H", 30.48),
+        ],
+        [
+            ("2020-12-14T05:00:00+00:00/PT2H", 90),
+            ("2020-12-14T07:00:00+00:00/PT5H", 40),
+            ("2020-12-14T12:00:00+00:00/P1D", 60),
+        ],
+    ),
+    "days and hours": make_data(
+        [
+            ("2020-12-14T05:00:00+00:00/P1DT6H", 25.4),
+            ("2020-12-15T11:00:00+00:00/P1D", 5.08),
+        ],
+        [
+            ("2020-12-14T05:00:00+00:00/P1DT6H", 70),
+            ("2020-12-15T11:00:00+00:00/PT12H", 20),
+            ("2020-12-15T23:00:00+00:00/PT12H", 85),
+        ],
+    ),
+    # The probability series starts late and has a gap, so some snowfall has no
+    # probability at all
+    "missing probability": make_data(
+        [
+            ("2020-12-14T05:00:00+00:00/PT3H", 7.62),
+            ("2020-12-14T08:00:00+00:00/PT3H", 5.08),
+            ("2020-12-14T14:00:00+00:00/PT6H", 10.16),
+            ("2020-12-16T05:00:00+00:00/PT2H", 2.54),
+        ],
+        [
+            ("2020-12-14T09:00:00+00:00/PT3H", 80),
+            ("2020-12-14T17:00:00+00:00/PT6H", 55),
+        ],
+    ),
+    "no probabilities": make_data(
+        [("2020-12-14T05:00:00+00:00/PT6H", 12.7)],
+        [],
+    ),
+}
+
+
+def get_cases():
+    cases = [pytest.param(data, id=name) for name, data in CASES.items()]
+    for seed in range(50):
+        days = 3 if seed % 2 else 7
+        cases.append(
+            pytest.param(
+                make_gridpoint(days, seed, START), id="synthetic-{}".format(seed)
+            )
+        )
+    return cases
+
+
+def assert_same_forecast(forecast, expected):
+    assert forecast.keys() == expected.keys()
+    for day, total in expected.items():
+        assert forecast[day] == pytest.approx(total), day
+
+
+@pytest.mark.parametrize("data", get_cases())
+@pytest.mark.parametrize(
+    "thresholds", [THRESHOLDS, [0, 50]], ids=["timeline", "one at a time"]
+)
+def test_thresholds_match_parse_snow_data(data, thresholds):
+    forecasts = parse_snow_data_thresholds(data, DATE_RANGE, TIMEZONE, thresholds)
+    assert sorted(forecasts) == sorted(thresholds)
+    for threshold in thresholds:
+        expected = parse_snow_data(data, DATE_RANGE, TIMEZONE, threshold)
+        assert_same_forecast(forecasts[threshold], expected)
+
+
+@pytest.mark.parametrize("data", get_cases())
+@pytest.mark.parametrize("threshold", [0, 50])
+def test_incremental_matches_parse_snow_data(data, threshold):
+    forecast = IncrementalForecast(TIMEZONE, threshold)
+    forecast.update(data)
+    expected = parse_snow_data(data, DATE_RANGE, TIMEZONE, threshold)
+    assert_same_forecast(forecast.get_forecast(DATE_RANGE), expected)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_update_matches_parse_snow_data(seed):
+    """Updating with the next forecast gives the same result as parsing it fresh."""
+    forecast = IncrementalForecast(TIMEZONE)
+    for data in [make_gridpoint(7, seed, START), make_gridpoint(7, seed + 1, START)]:
+        forecast.update(data)
+        expected = parse_snow_data(data, DATE_RANGE, TIMEZONE)
+        assert_same_forecast(forecast.get_forecast(DATE_RANGE), expected)
+
+
+class FakeResponse:
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i : i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def test_fetch_layers_defers_validators(monkeypatch, tmp_path):
+    """A gridpoint's validators aren't stored until the caller says its forecast
+    has been, so a run that fails after fetching it fetches it in full next time."""
+    monkeypatch.setattr(http_cache, "CACHE_DIR", str(tmp_path))
+    url = "https://api.weather.gov/gridpoints/BOX/1,2"
+    body = json.dumps(make_document(make_gridpoint(1, 0, START))).encode()
+    resp = FakeResponse(body, {"ETag": '"abc"'})
+    monkeypatch.setattr(utils, "get", lambda *args, **kwargs: resp)
+    values, update_cache = utils.fetch_layers(url, GRIDPOINT_LAYERS, conditional=True)
+    assert set(values) == set(GRIDPOINT_LAYERS)
+    assert http_cache.load_entry(url) is None
+    update_cache()
+    assert http_cache.load_entry(url)["etag"] == '"abc"'
+
+
+def test_validators_wait_for_every_location_in_cell(monkeypatch):
+    stored_cells = []
+
+    def get_snow_data(location, update_cache=True):
+        cell = location["office"]
+        return {"cell": cell}, lambda: stored_cells.append(cell)
+
+    monkeypatch.setattr(forecast, "get_snow_data", get_snow_data)
+    locations = [
+        {"name": "A", "office": "BOX", "grid_x": 1, "grid_y": 1},
+        {"name": "B", "office": "BOX", "grid_x": 1, "grid_y": 1},
+        {"name": "C", "office": "OKX", "grid_x": 1, "grid_y": 1},
+    ]
+    fetches = GridpointFetches()
+    for location in locations:
+        assert fetches.get(location) == {"cell": location["office"]}
+    # B failed, so the cell it shares with A has to be fetched in full next run
+    fetches.store_validators({"A", "C"})
+    assert stored_cells == ["OKX"]
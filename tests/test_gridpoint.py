@@ -0,0 +1,124 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+from urllib.parse import urlsplit
+
+import pytest
+
+from benchmarks.synthetic import make_document, make_gridpoint
+from scripts import utils
+from scripts.client import HttpClient
+from scripts.gridpoint import GRIDPOINT_LAYERS, extract_layers
+from scripts.metrics import metrics
+
+PROPERTIES = make_gridpoint(2, seed=1)
+# Every layer the bot reads, between layers it doesn't
+DOCUMENT = json.dumps(
+    make_document(
+        {
+            "updateTime": "2020-12-14T05:00:00+00:00",
+            "temperature": {"values": [{"validTime": "x", "value": "❄" * 50}]},
+            **PROPERTIES,
+            "weather": {"values": []},
+        }
+    ),
+    ensure_ascii=False,
+).encode()
+EXPECTED = {"updateTime": "2020-12-14T05:00:00+00:00", **PROPERTIES}
+
+
+def split(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(DOCUMENT)])
+def test_chunk_boundaries(size):
+    """Keys, values, and multibyte characters can all be split between chunks."""
+    assert extract_layers(split(DOCUMENT, size)) == EXPECTED
+
+
+def test_every_split_point():
+    for i in range(1, len(DOCUMENT)):
+        assert extract_layers([DOCUMENT[:i], DOCUMENT[i:]]) == EXPECTED
+
+
+def test_whitespace_around_colon():
+    document = b'{"updateTime"  :\n  "2020",\n"snowfallAmount" : {"values": []}}'
+    layers = {"updateTime": str, "snowfallAmount": dict}
+    assert extract_layers(split(document, 1), layers) == {
+        "updateTime": "2020",
+        "snowfallAmount": {"values": []},
+    }
+
+
+def test_key_as_a_value():
+    """A string that looks like a key, but isn't followed by a colon, is skipped."""
+    document = b'{"name": "updateTime", "other": ["updateTime"], "updateTime": "2020"}'
+    assert extract_layers(split(document, 5), {"updateTime": str}) == {
+        "updateTime": "2020"
+    }
+
+
+def test_value_of_wrong_type():
+    """Only the first occurrence with the expected type counts."""
+    document = (
+        b'{"snowfallAmount": "n/a", "nested": {"snowfallAmount": {"values": [1]}}}'
+    )
+    assert extract_layers(split(document, 4), {"snowfallAmount": dict}) == {
+        "snowfallAmount": {"values": [1]}
+    }
+
+
+def test_stops_once_layers_are_found():
+    chunks = iter(split(DOCUMENT, 64) + [b"not JSON"])
+    extract_layers(chunks, {"updateTime": str})
+    assert next(chunks)
+
+
+def test_missing_layer():
+    with pytest.raises(ValueError, match="probabilityOfPrecipitation"):
+        extract_layers(
+            split(json.dumps({"updateTime": "x", "snowfallAmount": {}}).encode(), 3)
+        )
+
+
+def test_read_layers_reuses_connection(serve, database, monkeypatch):
+    """The rest of the body is read once the layers are found, so that the
+    connection goes back to the pool instead of being dropped."""
+    padding = json.dumps({"padding": "x" * 1000000})
+    body = DOCUMENT[:-1] + b", " + padding[1:].encode()
+    server = serve((200, {}, body))
+    connections = []
+    process_request = server.httpd.process_request
+
+    def count_connection(request, client_address):
+        connections.append(client_address)
+        process_request(request, client_address)
+
+    server.httpd.process_request = count_connection
+    monkeypatch.setattr(utils, "_client", HttpClient(utils.HEADERS, retries=0))
+    metrics.reset()
+
+    for _ in range(3):
+        values, _ = utils.fetch_layers(server.url, GRIDPOINT_LAYERS)
+        assert values == EXPECTED
+    assert len(connections) == 1
+    assert metrics.hosts[urlsplit(server.url).netloc]["bytes"] == 3 * len(body)
@@ -0,0 +1,131 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import time
+
+import pytest
+
+from scripts import http_cache, utils
+from scripts.client import HttpClient
+from scripts.utils import HEADERS, NOT_MODIFIED
+
+LAST_MODIFIED = "Mon, 14 Dec 2020 05:00:00 GMT"
+DOCUMENT = json.dumps({"properties": {"updateTime": "2020-12-14T05:00:00+00:00"}})
+LAYERS = {"updateTime": str}
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    """A scratch cache directory, and a client of its own for utils to use."""
+    monkeypatch.setattr(http_cache, "CACHE_DIR", str(tmp_path / "http_cache"))
+    monkeypatch.setattr(utils, "_client", HttpClient(HEADERS, retries=0))
+
+
+def test_not_modified_keeps_validators(cache, serve):
+    """A 304 needn't resend the validators, and its own lifetime replaces the old."""
+    server = serve((304, {"Cache-Control": "max-age=60"}, b""))
+    url = server.url + "/document"
+    http_cache.store_entry(
+        url,
+        {"ETag": '"a"', "Last-Modified": LAST_MODIFIED, "Cache-Control": "no-cache"},
+    )
+
+    assert utils.get(url, conditional=True) is NOT_MODIFIED
+    assert server.received[0]["If-None-Match"] == '"a"'
+    assert server.received[0]["If-Modified-Since"] == LAST_MODIFIED
+    entry = http_cache.load_entry(url)
+    assert entry["etag"] == '"a"'
+    assert entry["last_modified"] == LAST_MODIFIED
+    assert http_cache.is_fresh(entry)
+
+
+def test_not_modified_without_update_cache(cache, serve):
+    server = serve((304, {"Cache-Control": "max-age=60"}, b""))
+    url = server.url + "/document"
+    http_cache.store_entry(url, {"ETag": '"a"', "Cache-Control": "no-cache"})
+
+    assert utils.get(url, conditional=True, update_cache=False) is NOT_MODIFIED
+    assert not http_cache.is_fresh(http_cache.load_entry(url))
+
+
+def test_fresh_entry_skips_request(cache, serve):
+    server = serve((200, {}, b""))
+    url = server.url + "/document"
+    http_cache.store_entry(url, {"ETag": '"a"', "Cache-Control": "max-age=60"})
+
+    assert utils.get(url, conditional=True) is NOT_MODIFIED
+    assert server.requests == 0
+
+
+def test_unconditional_request_ignores_entry(cache, serve):
+    server = serve((200, {}, b"body"))
+    url = server.url + "/document"
+    http_cache.store_entry(url, {"ETag": '"a"', "Cache-Control": "max-age=60"})
+
+    assert utils.get(url).text == "body"
+    assert "If-None-Match" not in server.received[0]
+
+
+def test_changed_document_stores_validators_once_handled(cache, serve):
+    """fetch_layers leaves storing the new validators to the caller, so that a run
+    which fails after the fetch doesn't get a 304 for the change next time."""
+    server = serve(
+        (200, {"ETag": '"b"'}, DOCUMENT.encode()),
+        (304, {"ETag": '"b"'}, b""),
+    )
+    url = server.url + "/document"
+    http_cache.store_entry(url, {"ETag": '"a"', "Cache-Control": "no-cache"})
+
+    values, store_validators = utils.fetch_layers(url, LAYERS, conditional=True)
+    assert values == {"updateTime": "2020-12-14T05:00:00+00:00"}
+    assert http_cache.load_entry(url)["etag"] == '"a"'
+    store_validators()
+    assert http_cache.load_entry(url)["etag"] == '"b"'
+
+    assert utils.fetch_layers(url, LAYERS, conditional=True) == (NOT_MODIFIED, None)
+    assert server.received[1]["If-None-Match"] == '"b"'
+
+
+def test_no_store(cache):
+    http_cache.store_entry("https://example.com/", {"Cache-Control": "no-store"})
+    assert http_cache.load_entry("https://example.com/") is None
+
+
+def test_get_expiry():
+    date = "Mon, 14 Dec 2020 05:00:00 GMT"
+    start = http_cache.parse_http_date(date)
+    assert http_cache.get_expiry({"Date": date, "Cache-Control": "max-age=60"}) == (
+        start + 60
+    )
+    assert (
+        http_cache.get_expiry(
+            {"Date": date, "Expires": "Mon, 14 Dec 2020 06:00:00 GMT"}
+        )
+        == start + 3600
+    )
+    assert http_cache.get_expiry({"Cache-Control": "no-cache, max-age=60"}) == 0
+    assert http_cache.get_expiry({"Expires": "0"}) == 0
+    assert http_cache.get_expiry({}) == 0
+    assert (
+        time.time() + 59
+        <= http_cache.get_expiry({"Cache-Control": "public, max-age=60"})
+        <= time.time() + 60
+    )
@@ -0,0 +1,56 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import requests
+
+from scripts import points, utils
+
+LOCATION = {"name": "Boston", "latitude": 42.3601, "longitude": -71.0589}
+
+
+def make_response(body):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = body
+    return resp
+
+
+def test_point_lookup_that_isnt_json(database, monkeypatch):
+    """An error page in place of the point's JSON is a failed lookup, not a crash."""
+    monkeypatch.setattr(
+        utils, "get", lambda url: make_response(b"<html>Service Unavailable</html>")
+    )
+    assert points.fetch_point(42.3601, -71.0589) is None
+    assert points.resolve_location(LOCATION) is None
+
+
+def test_point_lookup(database, monkeypatch):
+    body = (
+        b'{"properties": {"gridId": "BOX", "gridX": 71, "gridY": 90,'
+        b' "timeZone": "America/New_York"}}'
+    )
+    monkeypatch.setattr(utils, "get", lambda url: make_response(body))
+    assert points.resolve_location(LOCATION) == {
+        "office": "BOX",
+        "grid_x": 71,
+        "grid_y": 90,
+        "timezone": "America/New_York",
+        **LOCATION,
+    }
@@ -0,0 +1,181 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from urllib.parse import parse_qs
+import time
+
+import pytest
+
+from benchmarks.fakes import FakePosting
+from scripts import posting, store
+from scripts.posting import PostingQueue
+
+CREDENTIALS = dict.fromkeys(
+    ["consumer_api_key", "consumer_api_secret", "access_token", "access_key"], "x"
+)
+ACCOUNTS = {"account": CREDENTIALS, "other account": CREDENTIALS}
+
+
+class RecordingPosting(FakePosting):
+    """Keeps the form of every post it's sent."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.posts = []
+
+    def respond(self, method, path, headers, body):
+        with self.lock:
+            self.posts.append(
+                {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            )
+        return super().respond(method, path, headers, body)
+
+
+@pytest.fixture
+def twitter(database, start_server):
+    """Start a fake Twitter with twitter(**options); see FakePosting."""
+    return lambda **options: start_server(RecordingPosting(**options))
+
+
+def make_queue(server, name="twitter"):
+    return PostingQueue(name, ACCOUNTS, server.url + "/1.1")
+
+
+def get_outbox():
+    """Return (text, status, attempts, tweet ID, error) for every post, in order."""
+    return (
+        store.get_connection()
+        .execute(
+            "SELECT text, status, attempts, tweet_id, error FROM outbox "
+            "ORDER BY thread_id, position"
+        )
+        .fetchall()
+    )
+
+
+def test_thread_is_posted_as_replies(twitter):
+    server = twitter()
+    queue = make_queue(server)
+    queue.enqueue("account", ["one", "two", "three"])
+    queue.drain(timeout=5)
+
+    assert get_outbox() == [
+        ("one", "sent", 1, "1", None),
+        ("two", "sent", 1, "2", None),
+        ("three", "sent", 1, "3", None),
+    ]
+    assert [post["status"] for post in server.posts] == ["one", "two", "three"]
+    assert [post.get("in_reply_to_status_id") for post in server.posts] == [
+        None,
+        "1",
+        "2",
+    ]
+
+
+def test_rate_limit(twitter):
+    """A 429 leaves the post queued until the rate limit resets, and it's posted
+    then if that's before the deadline."""
+    # The reset is rounded down to the second, so this is at least a second away
+    server = twitter(rate_limit_rate=1, rate_limit_window=2)
+    queue = make_queue(server)
+    queue.enqueue("account", ["one"])
+    start = time.time()
+    queue.drain(timeout=0.2)
+
+    ((_, _, _, next_attempt_at, _),) = store.get_next_posts("twitter", "account")
+    assert get_outbox() == [("one", "pending", 1, None, "Rate limited")]
+    assert start + 1 <= next_attempt_at <= start + 3
+
+    server.rate_limit_rate = 0
+    queue.drain(timeout=5)
+    assert time.time() >= next_attempt_at
+    assert get_outbox() == [("one", "sent", 2, "1", "Rate limited")]
+    assert server.get_stats() == {429: 1, 200: 1}
+
+
+def test_server_errors_are_retried_with_backoff(twitter, monkeypatch):
+    monkeypatch.setattr(posting, "POSTING_BACKOFF", 0.01)
+    monkeypatch.setattr(posting, "POSTING_RETRIES", 3)
+    server = twitter(error_rate=1)
+    queue = make_queue(server)
+    queue.enqueue("account", ["one", "two"])
+    queue.drain(timeout=5)
+
+    assert get_outbox() == [
+        ("one", "failed", 3, None, "HTTP 503"),
+        ("two", "failed", 0, None, "Earlier post failed"),
+    ]
+    assert server.get_stats() == {503: 3}
+
+
+def test_backoff_outlasting_deadline_leaves_post_queued(twitter):
+    server = twitter(error_rate=1)
+    queue = make_queue(server)
+    queue.enqueue("account", ["one"])
+    queue.drain(timeout=1)
+
+    ((_, _, _, next_attempt_at, _),) = store.get_next_posts("twitter", "account")
+    assert next_attempt_at >= time.time() + posting.POSTING_BACKOFF - 1
+    assert get_outbox() == [("one", "pending", 1, None, "HTTP 503")]
+    assert server.get_stats() == {503: 1}
+
+
+def test_permanent_failure(twitter):
+    """A post that's refused isn't retried, and the rest of its thread is given up
+    on, but not the account's other threads."""
+    server = twitter()
+    queue = make_queue(server)
+    # FakePosting refuses an empty status with a 400
+    queue.enqueue("account", ["", "two"])
+    queue.enqueue("account", ["other thread"])
+    queue.drain(timeout=5)
+
+    assert get_outbox() == [
+        ("", "failed", 1, None, "HTTP 400: "),
+        ("two", "failed", 0, None, "Earlier post failed"),
+        ("other thread", "sent", 1, "1", None),
+    ]
+
+
+def test_account_without_credentials_stays_queued(twitter):
+    server = twitter()
+    queue = make_queue(server)
+    queue.enqueue("unknown account", ["one"])
+    queue.enqueue("other account", ["two"])
+    queue.drain(timeout=5)
+
+    assert get_outbox() == [
+        ("one", "pending", 0, None, None),
+        ("two", "sent", 1, "1", None),
+    ]
+
+
+def test_queues_post_their_own_threads(twitter):
+    server = twitter()
+    queue = make_queue(server)
+    other_queue = make_queue(server, "other twitter")
+    queue.enqueue("account", ["one"])
+    other_queue.enqueue("account", ["two"])
+    queue.drain(timeout=5)
+
+    assert get_outbox() == [
+        ("one", "sent", 1, "1", None),
+        ("two", "pending", 0, None, None),
+    ]
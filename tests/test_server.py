@@ -0,0 +1,45 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from http import HTTPStatus
+
+import pytest
+
+from scripts.server import ForecastServer, make_resource
+
+
+@pytest.mark.parametrize(
+    "name, target",
+    [
+        ("Boston", "/forecasts/Boston"),
+        ("New York", "/forecasts/New%20York"),
+        ("New York", "/forecasts/New%20York/?units=mm"),
+        ("Montréal", "/forecasts/Montr%C3%A9al"),
+    ],
+)
+def test_location_paths_are_unescaped(name, target):
+    server = ForecastServer(locations=[])
+    body, etag = server.resources["/forecasts/" + name] = make_resource(
+        {"location": name}
+    )
+    status, headers, response_body = server.respond("GET", target, {})
+    assert status == HTTPStatus.OK
+    assert response_body == body
+    assert headers["ETag"] == etag
@@ -0,0 +1,164 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from argparse import Namespace
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timezone
+import cProfile
+import pstats
+import threading
+
+import pytest
+
+from benchmarks.synthetic import make_gridpoint
+from config import TIMEZONE
+from scripts import forecast
+from scripts.forecast import get_date_range
+from scripts.metrics import Profiler
+from scripts.utils import NOT_MODIFIED
+import snowbot
+
+LOCATION = {
+    "name": "Boston",
+    "office": "BOX",
+    "grid_x": 71,
+    "grid_y": 90,
+    "timezone": TIMEZONE,
+    "sinks": ["twitter"],
+}
+DATE_RANGE = get_date_range(date(2020, 12, 14))
+DATA = make_gridpoint(7, 0, datetime(2020, 12, 14, 5, tzinfo=timezone.utc))
+
+
+class NotModifiedFetches:
+    """A GridpointFetches whose grid cell's validators are already stored."""
+
+    def get(self, location):
+        return NOT_MODIFIED
+
+
+def make_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+@pytest.fixture
+def fetched(monkeypatch, database):
+    """Record unconditional fetches, which return DATA."""
+    calls = []
+
+    def get_snow_data(location, update_cache=True, conditional=True):
+        calls.append(conditional)
+        return DATA, None
+
+    monkeypatch.setattr(snowbot, "get_snow_data", get_snow_data)
+    monkeypatch.setattr(snowbot, "_publisher", None)
+    return calls
+
+
+def test_new_location_in_fetched_cell_gets_forecast(fetched):
+    """A location with nothing stored isn't held to another location's 304."""
+    result = snowbot.run_location(
+        LOCATION,
+        DATE_RANGE,
+        None,
+        True,
+        fetches=NotModifiedFetches(),
+        stored_forecast=make_future(None),
+    )
+    assert fetched == [False]
+    assert result["forecast"] is not None
+
+
+@pytest.mark.parametrize("amount", [0, 12.7])
+def test_unchanged_location_is_skipped(fetched, monkeypatch, amount):
+    """An unchanged location isn't fetched again, and whether it has snow comes from
+    the stored forecast that was already being read for it."""
+    monkeypatch.setattr(
+        snowbot,
+        "get_stored_snow_data",
+        lambda *args: pytest.fail("read the stored forecast again"),
+    )
+    stored = {d.isoformat(): amount for d in DATE_RANGE}
+    result = snowbot.run_location(
+        LOCATION,
+        DATE_RANGE,
+        None,
+        True,
+        fetches=NotModifiedFetches(),
+        stored_forecast=make_future(stored),
+    )
+    assert fetched == []
+    assert result["forecast"] is None
+    assert result["has_snow"] == bool(amount)
+
+
+class ExclusiveProfile(cProfile.Profile):
+    """A profiler that, like cProfile from Python 3.12, refuses to start while
+    another is active."""
+
+    lock = threading.Lock()
+    active = None
+
+    def enable(self, *args, **kwargs):
+        with ExclusiveProfile.lock:
+            if ExclusiveProfile.active is not None:
+                raise ValueError("Another profiling tool is already active")
+            ExclusiveProfile.active = self
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        with ExclusiveProfile.lock:
+            if ExclusiveProfile.active is self:
+                ExclusiveProfile.active = None
+
+
+@pytest.mark.parametrize("exclusive", [False, True], ids=["per-thread", "exclusive"])
+def test_run_once_with_profiler(fetched, monkeypatch, tmp_path, exclusive):
+    """Profiling wraps each location's run inside the profiled run_once, as
+    --daemon --profile does, and mustn't make any of them fail."""
+    if exclusive:
+        monkeypatch.setattr(cProfile, "Profile", ExclusiveProfile)
+    monkeypatch.setattr(snowbot, "LOCATIONS", [LOCATION, {**LOCATION, "name": "Two"}])
+    monkeypatch.setattr(
+        forecast, "get_snow_data", lambda location, update_cache=True: (DATA, None)
+    )
+    failures = []
+
+    def log(message, level="info", **fields):
+        if level == "error":
+            failures.append(message)
+
+    monkeypatch.setattr(snowbot, "log", log)
+    args = Namespace(dry_run=True, compare_to=None, metrics=None)
+    profiler = Profiler()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = profiler.runcall(snowbot.run_once, args, executor, profiler)
+    assert failures == []
+    assert sorted(results) == ["Boston", "Two"]
+    path = str(tmp_path / "snowbot.prof")
+    profiler.dump(path)
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    assert "run_once" in functions
+    if not exclusive:
+        # Each thread's calls are profiled on their own, and merged in
+        assert "run_location" in functions
@@ -0,0 +1,122 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import threading
+
+from scripts import store
+
+NUM_THREADS = 16
+# The race doesn't come up every time, so it's run a few times over
+ROUNDS = 25
+# The outbox as it was before posts were queued per sink
+OLD_OUTBOX_SCHEMA = """
+CREATE TABLE outbox (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    thread_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    tweet_id TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE (thread_id, position)
+);
+CREATE INDEX outbox_pending ON outbox (account, status, thread_id);
+INSERT INTO outbox (account, thread_id, position, text, created_at)
+VALUES ('account', 1, 0, 'queued before the upgrade', 0);
+"""
+
+
+def test_concurrent_enqueue(database):
+    """Locations run on their own threads, so threads are often queued at once."""
+    # Open every thread's connection before any of them enqueue, so that they
+    # really do race
+    barrier = threading.Barrier(NUM_THREADS)
+
+    def enqueue(i):
+        store.get_connection()
+        barrier.wait()
+        return store.enqueue_thread(
+            "twitter", "account", ["{} {}".format(i, n) for n in range(3)]
+        )
+
+    thread_ids = []
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+        for start in range(0, NUM_THREADS * ROUNDS, NUM_THREADS):
+            thread_ids.extend(executor.map(enqueue, range(start, start + NUM_THREADS)))
+    assert len(set(thread_ids)) == len(thread_ids)
+
+    rows = store.get_connection().execute(
+        "SELECT thread_id, position, text FROM outbox ORDER BY thread_id, position"
+    )
+    threads = {}
+    for thread_id, position, text in rows:
+        threads.setdefault(thread_id, []).append((position, text))
+    assert sorted(threads) == sorted(thread_ids)
+    for i, thread_id in enumerate(thread_ids):
+        assert threads[thread_id] == [(n, "{} {}".format(i, n)) for n in range(3)]
+
+
+def test_sinks_post_their_own_threads(database):
+    """Two sinks of the same type share the outbox, and mustn't drain each other's."""
+    store.enqueue_thread("twitter", "account", ["first"])
+    store.enqueue_thread("other twitter", "account", ["second"])
+    store.enqueue_thread("other twitter", "other account", ["third"])
+
+    assert store.get_pending_accounts("twitter") == ["account"]
+    assert sorted(store.get_pending_accounts("other twitter")) == [
+        "account",
+        "other account",
+    ]
+    assert [post[1] for post in store.get_next_posts("twitter", "account")] == ["first"]
+    assert [post[1] for post in store.get_next_posts("other twitter", "account")] == [
+        "second"
+    ]
+    assert store.get_next_posts("twitter", "other account") == []
+
+
+def test_upgrade_outbox(database):
+    """Posts queued before the outbox had a sink column belong to the default sink."""
+    conn = sqlite3.connect(store.DATABASE_PATH)
+    with conn:
+        conn.executescript(OLD_OUTBOX_SCHEMA)
+    conn.close()
+
+    assert store.get_pending_accounts("twitter") == ["account"]
+    assert [post[1] for post in store.get_next_posts("twitter", "account")] == [
+        "queued before the upgrade"
+    ]
+    thread_id = store.enqueue_thread("other twitter", "account", ["after"])
+    assert thread_id == 2
+    assert [post[1] for post in store.get_next_posts("other twitter", "account")] == [
+        "after"
+    ]
+    indexes = [
+        row[0]
+        for row in store.get_connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'outbox'"
+        )
+    ]
+    assert "outbox_pending" not in indexes
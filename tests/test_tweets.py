@@ -0,0 +1,118 @@
+# Copyright (c) 2015–2020 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from scripts.tweets import (
+    CONTINUED,
+    TWEET_LENGTH,
+    get_weighted_length,
+    make_tweets,
+)
+
+
+@pytest.mark.parametrize(
+    "text, length",
+    [
+        ("Mon, 12/14: 3 in.", 17),
+        ("é—", 1 + 1),
+        ("日本", 2 * 2),
+        ("❄️", 2),
+        ("👍🏽", 2),
+        ("👩‍👩‍👧", 2),
+        ("1️⃣", 2),
+        ("https://example.com/a/very/long/path/to/somewhere", 23),
+        ("see http://t.co/x ❄️", 4 + 23 + 1 + 2),
+    ],
+    ids=[
+        "ascii",
+        "latin",
+        "cjk",
+        "emoji",
+        "skin tone",
+        "zwj sequence",
+        "keycap",
+        "link",
+        "mixed",
+    ],
+)
+def test_weighted_length(text, length):
+    assert get_weighted_length(text) == length
+
+
+def check_thread(tweets, sentences):
+    assert all(get_weighted_length(tweet) <= TWEET_LENGTH for tweet in tweets)
+    assert all(tweet.startswith(CONTINUED + "\n") for tweet in tweets[1:])
+    text = "\n".join(
+        tweet[len(CONTINUED) + 1 :] if i else tweet for i, tweet in enumerate(tweets)
+    )
+    for sentence in sentences:
+        assert sentence in text
+
+
+def test_fits_in_one_tweet():
+    sentences = ["Mon, 12/14: 3 in.", "Tue, 12/15: <1 in."]
+    assert make_tweets(sentences, "Toast") == [
+        "Mon, 12/14: 3 in.\nTue, 12/15: <1 in.\n\nToast"
+    ]
+
+
+@pytest.mark.parametrize("char", ["a", "❄️", "日"], ids=["ascii", "emoji", "cjk"])
+def test_at_the_limit(char):
+    """Exactly TWEET_LENGTH fits, by weight rather than by len."""
+    first = char * (TWEET_LENGTH // 2 // get_weighted_length(char))
+    # Less the newline between them
+    second = "a" * (TWEET_LENGTH - get_weighted_length(first) - 1)
+    assert make_tweets([first, second]) == [first + "\n" + second]
+    tweets = make_tweets([first, second + "a"])
+    assert tweets == [first, CONTINUED + "\n" + second + "a"]
+
+
+def test_emoji_threads_by_weight():
+    """A thread of emoji-heavy sentences is split as Twitter counts them, where
+    len() would have packed them into one tweet."""
+    sentences = ["❄" * 30 + " day {}".format(i) for i in range(5)]
+    assert sum(len(sentence) + 1 for sentence in sentences) <= TWEET_LENGTH
+    tweets = make_tweets(sentences)
+    assert len(tweets) > 1
+    check_thread(tweets, sentences)
+
+
+def test_long_sentence_is_split_at_spaces():
+    sentence = " ".join("word{}".format(i) for i in range(100))
+    tweets = make_tweets([sentence])
+    assert len(tweets) > 1
+    check_thread(tweets, [])
+    assert (
+        " ".join(tweet.split("\n")[-1] for tweet in tweets).split() == sentence.split()
+    )
+
+
+def test_long_word_is_cut():
+    tweets = make_tweets(["❄" * 400])
+    assert len(tweets) > 1
+    check_thread(tweets, [])
+    assert "".join(tweet.split("\n")[-1] for tweet in tweets) == "❄" * 400
+
+
+def test_sentences_are_left_as_they_were():
+    sentences = ["a" * 300, "b"]
+    make_tweets(sentences, "c")
+    assert sentences == ["a" * 300, "b"]